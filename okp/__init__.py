@@ -1 +1,23 @@
 from .main_impl import main
+
+# the library api is only imported when it's used, so running okp doesn't
+# pay for it at startup
+LAZY_NAMES = {
+    "transpile": "api",
+    "transpile_project": "api",
+    "GeneratedFile": "api",
+    "TranspileContext": "context",
+    "BuildContext": "context",
+}
+
+def __getattr__(name):
+    if name not in LAZY_NAMES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    import importlib
+    value = getattr(importlib.import_module("." + LAZY_NAMES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY_NAMES))
@@ -4,11 +4,62 @@ from .util import *
 import os
 
 from . import id_recognizer
+from . import lexer
+# scopes are chained frames instead of copies. a frame only stores the
+# identifiers declared in it, mapped to the line that declared them, and
+# sees its parent as it was when the frame was opened (identifiers the
+# parent gains later are not visible). a lookup walks at most one frame per
+# nesting level, so memory stays linear in the number of identifiers
+class Scope(object):
+    __slots__ = ("parent", "opened", "names", "line")
+
+    def __init__(self, parent=None, opened=0):
+        self.parent = parent
+        self.opened = opened
+        self.names = {}
+        # line that identifiers added through scope[name] are stamped with
+        self.line = opened
+
+    # is name visible in this scope to the start of line `before`?
+    def visible(self, name, before=None):
+        scope = self
+        while scope is not None:
+            line = scope.names.get(name)
+            if line is not None and (before is None or line < before):
+                return True
+
+            if before is None or scope.opened < before:
+                before = scope.opened
+            scope = scope.parent
+
+        return False
+
+    def __contains__(self, name):
+        return self.visible(name)
+
+    def __setitem__(self, name, value):
+        if name not in self.names:
+            self.names[name] = self.line
+
+    def child(self, line):
+        return Scope(self, line)
+
+# the identifiers a line can see: its scope as it was before the line
+class ScopeView(object):
+    __slots__ = ("scope", "line")
+
+    def __init__(self, scope, line):
+        self.scope = scope
+        self.line = line
+
+    def __contains__(self, name):
+        return self.scope.visible(name, self.line)
+
 def read_scopings(lines):
     indent_levels = [0]
     nb = 0
-    scopings = {}
-    scope = {}
+    scopings = []
+    scope = Scope()
     scope_stack = { 0: scope }
 
 
@@ -19,10 +70,10 @@ def read_scopings(lines):
         if indent in scope_stack:
             scope = scope_stack[indent]
         else:
-            scope = {}
+            scope = Scope(None, i)
             scope_stack[indent] = scope
 
-        scopings[i] = [c for c in scope]
+        scopings.append(ScopeView(scope, i))
 
         if not line:
             continue
@@ -43,7 +94,7 @@ def read_scopings(lines):
             if not visibility_line(lines[nb]):
                 indent_levels.append(indent)
 
-                scope = dict([(c, c) for c in scope])
+                scope = scope.child(i)
                 scope_stack[indent] = scope
 
         if i < len(lines) - 1:
@@ -56,9 +107,10 @@ def read_scopings(lines):
             next_indent = get_indent(next_line)
 
             if indent < next_indent:
-                scope = dict([(c, c) for c in scope])
+                scope = scope.child(i)
                 scope_stack[next_indent] = scope
 
+        scope.line = i
         new = id_recognizer.add_identifiers(line, scope)
 
         # compare libclang vs. our own version
@@ -124,59 +176,93 @@ def file_contains_main(lines):
 
     return False
 
-def gather_includes(file, includes, base_dir=None):
-    file_path = os.path.join(base_dir or '', file)
-    if file_path in includes:
-        return
-
-    valid_exts = [".h", ".cpy", ".cpp", ".c", ".hpp"]
-    valid_ext = False
-    for ext in valid_exts:
-        if file.endswith(ext):
-            valid_ext = True
-
-    if not valid_ext:
-        return
-
-    dirname = os.path.dirname(file)
-    fname = os.path.basename(file)
-
-    if base_dir == None:
-        base_dir = dirname
-    else:
-        base_dir = os.path.join(base_dir, dirname)
-
-    if not os.path.exists(file_path):
-        print("missing file:", file)
-        return
-
-    file = os.path.join(base_dir, fname)
-    if not file_path.endswith(".cpp"):
-        includes[file_path] = True
+SOURCE_EXTS = (".h", ".cpy", ".cpp", ".c", ".hpp")
+
+# the "quoted" includes of every file we've read, keyed by absolute path.
+# entries are checked against the file's mtime and size, so a header that
+# many files include is only parsed once per run (and once more if it
+# changes, for okp --watch)
+INCLUDE_CACHE = {}
+
+def quoted_includes(path):
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    entry = INCLUDE_CACHE.get(key)
+    if entry and entry[0] == stamp:
+        return entry[1]
+
+    includes = []
+    with open(path) as f:
+        for line in f:
+            cline = line.strip()
+            if not cline.startswith("#include"):
+                continue
+            tokens = cline.split()
+            if len(tokens) < 2 or tokens[1][0] != '"':
+                continue
+            includes.append(tokens[1].strip('"'))
 
+    INCLUDE_CACHE[key] = (stamp, includes)
+    return includes
 
-    with open(file_path) as f:
-        lines = f.readlines()
+# walks the includes below file depth first. it keeps its own stack, so
+# long include chains can't hit the recursion limit. every include is
+# recorded in graph (if given) as an edge from the includer. each source
+# file is read once per seen set; before that, enter(file_path) can veto
+# walking into it. with prefer_cpy, including foo.h means foo.cpy when
+# there is one next to the includer
+def walk_includes(file, enter=None, base_dir=None, graph=None, parent=None,
+        prefer_cpy=False, seen=None):
+    if seen is None:
+        seen = set()
+
+    stack = [ (file, base_dir, parent) ]
+    while stack:
+        file, base_dir, parent = stack.pop()
+        file_path = os.path.join(base_dir or '', file)
+        norm_path = os.path.normpath(file_path)
+        if graph is not None and parent:
+            graph[os.path.normpath(parent)].add(norm_path)
+
+        if norm_path in seen or not file.endswith(SOURCE_EXTS):
+            continue
 
-    for line in lines:
-        cline = line.strip()
-        if cline.startswith("#include"):
-            tokens = cline.split()
-            include = tokens[1]
-            if include[0] != '"':
-                continue
-            include = include.strip('"')
+        if not os.path.exists(file_path):
+            debug("missing file:", file)
+            continue
 
-            fname, ext = os.path.splitext(include)
-            cpyname = "%s.cpy" % fname
-            if os.path.exists(os.path.join(base_dir, cpyname)):
-                gather_includes(cpyname, includes, base_dir)
-            else:
-                gather_includes(include, includes, base_dir)
+        if enter and not enter(file_path):
+            continue
+        seen.add(norm_path)
+
+        base_dir = os.path.join(base_dir or '', os.path.dirname(file))
+        children = []
+        for include in quoted_includes(file_path):
+            if prefer_cpy:
+                cpyname = "%s.cpy" % os.path.splitext(include)[0]
+                if os.path.exists(os.path.join(base_dir, cpyname)):
+                    include = cpyname
+            children.append((include, base_dir, file_path))
+
+        stack.extend(reversed(children))
+
+# adds file and everything it includes to includes, in the order they are
+# first seen. when graph is passed in, every include found is also
+# recorded as an edge from the including file to the included one
+def gather_includes(file, includes, base_dir=None, graph=None, parent=None):
+    def enter(file_path):
+        if file_path in includes:
+            return False
+
+        if not file_path.endswith(".cpp"):
+            includes[file_path] = True
+        return True
 
+    walk_includes(file, enter, base_dir, graph, parent, prefer_cpy=True)
     return includes
 
-def gather_files(files):
+def gather_files(files, graph=None):
     ret = {}
     original_dir = os.getcwd()
     for file in files:
@@ -187,81 +273,100 @@ def gather_files(files):
         if not os.path.exists(file):
             continue
         file_dir, filename = os.path.split(file)
-        gather_includes(filename, ret, file_dir)
+        gather_includes(filename, ret, file_dir, graph)
         ret[file] = True
 
     os.chdir(original_dir)
     return list(ret.keys())
 
-def guess_required_files(lines):
+# which header to include when a file uses one of these tokens. inferring
+# a header also brings in "using namespace std;", so a token that the
+# user's code could define itself (a global `int stack[N]` or its own
+# `pow`) would turn into a clash. only names that can't be mistaken for
+# the user's own are listed: std containers and streams, the make_* and
+# sto* helpers and C library names. generic ones like set, stack, string,
+# pair, sort or pow have to be asked for with okp --infer-include
+REQUIRE_KEYWORDS = {
+    "<iostream>" : [ "cout", "cin", "endl", "cerr" ],
+    "<vector>" : [ "vector" ],
+    "<tuple>" : [ "tuple", "make_tuple", "tie", "std::tie"],
+    "<queue>" : [ "queue", "priority_queue" ],
+    "<deque>" : [ "deque" ],
+    "<map>" : ["map", "multimap"],
+    "<unordered_map>" : ["unordered_map", "unordered_multimap"],
+    "<set>" : [ "multiset" ],
+    "<unordered_set>" : [ "unordered_set", "unordered_multiset" ],
+    "<bitset>" : [ "bitset" ],
+    "<string>" : [ "to_string", "stoi", "stol", "stoll", "stod" ],
+    "<sstream>" : [ "stringstream", "istringstream", "ostringstream" ],
+    "<fstream>" : [ "ifstream", "ofstream", "fstream" ],
+    "<iomanip>" : [ "setw", "setprecision", "setfill" ],
+    "<utility>" : [ "make_pair" ],
+    "<cstring>" : [ "memset", "memcpy", "strlen", "strcmp", "strcpy" ],
+    "<climits>" : [ "INT_MAX", "INT_MIN", "LLONG_MAX", "LLONG_MIN" ],
+    "<cstdio>" : ["printf", "scanf"],
+    "<memory>" : ["shared_ptr", "unique_ptr", "weak_ptr", "make_shared", "make_unique"]
+}
+
+DEFINE_KEYWORDS = {
+    "len(x) (int)(x).size()" : [ "len" ]
+}
+
+def index_keywords(keywords):
+    index = {}
+    for value, tokens in keywords.items():
+        for tok in tokens:
+            index.setdefault(tok, set()).add(value)
+    return index
+
+# token -> the headers (or defines) it needs
+REQUIRE_INDEX = index_keywords(REQUIRE_KEYWORDS)
+DEFINE_INDEX = index_keywords(DEFINE_KEYWORDS)
+
+# adds tokens for header to keywords, a header -> tokens dict like the
+# include_keywords of a TranspileContext. the module's tables are left
+# alone, so one build's extra headers don't leak into the next
+def add_include_keywords(keywords, header, tokens):
+    keywords.setdefault(header, [])
+    for tok in tokens:
+        if tok not in keywords[header]:
+            keywords[header].append(tok)
+    return keywords
+
+# the include tables come from ctx (a context.TranspileContext) if given
+def guess_required_files(lines, ctx=None):
+    require_index = ctx.require_index if ctx else REQUIRE_INDEX
+    define_index = ctx.define_index if ctx else DEFINE_INDEX
     requires = set()
     defines = set()
-
-    REQUIRE_KEYWORDS = {
-        "<iostream>" : [ "cout", "cin", "endl", "cerr" ],
-        "<vector>" : [ "vector" ],
-        "<tuple>" : [ "tuple", "make_tuple", "tie", "std::tie"],
-        "<queue>" : [ "queue" ],
-        "<deque>" : [ "deque" ],
-        "<map>" : ["map"],
-        "<unordered_map>" : ["unordered_map"],
-        "<cstdio>" : ["printf", "scanf"],
-        "<memory>" : ["shared_ptr", "unique_ptr", "weak_ptr"]
-    }
-
-    DEFINE_KEYWORDS = {
-        "len(x) (int)(x).size()" : [ "len" ]
-    }
-
-
-    def add_requires(line_tokens, require_tokens, require):
-        if not require in requires:
-            for tok in require_tokens:
-                if tok in line_tokens:
-                    requires.add(require)
-
-
-    def add_defines(line_tokens, define_tokens, word):
-        if not word in defines:
-            for tok in define_tokens:
-                if tok in line_tokens:
-                    defines.add(word)
-
+    # lines that might already include one of the required headers
+    include_lines = []
 
     using_namespace_std = False
     for line in lines:
         if not using_namespace_std and line.find("using namespace std;") != -1:
             using_namespace_std = True
+        if line.find("#include") != -1:
+            include_lines.append(line)
 
-        tokens = smart_split(line, " :<>()")
-        for require in REQUIRE_KEYWORDS:
-            add_requires(tokens, REQUIRE_KEYWORDS[require], require)
-
-        for define in DEFINE_KEYWORDS:
-            add_defines(tokens, DEFINE_KEYWORDS[define], define)
-
+        for tok in set(lexer.split(line, " :<>()")):
+            if tok in require_index:
+                requires.update(require_index[tok])
+            if tok in define_index:
+                defines.update(define_index[tok])
 
     prepend = []
     for r in requires:
-        prepend.append("#include %s" % r)
-
-    included = set()
-    for line in lines:
-        for p in prepend:
-            if line.find(p) != -1:
-                included.add(p);
-
-    prepend = list(filter(lambda w: w not in included, [ p for p in prepend]))
+        include = "#include %s" % r
+        if not any(line.find(include) != -1 for line in include_lines):
+            prepend.append(include)
     prepend.sort()
 
-    for d in defines:
+    for d in sorted(defines):
         prepend.append("#define %s" % d)
 
     if not using_namespace_std and requires:
         prepend.append("using namespace std;");
 
-
-
-
     return prepend
 
@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import os
+
+from .context import TranspileContext
+
+# okp as a library. transpile() doesn't read or change the config module,
+# so different options can be used from several threads at once:
+#
+#   import okp
+#   cpp = okp.transpile(open("foo.cpy").read(), enable_for=True)
+#
+# options are the arguments of context.TranspileContext (enable_for,
+# enable_rof, join_ending_periods, declare_variables, add_source_map,
+# extract_impl, project_impl_def, include_keywords, files). fname is used
+# in #line directives and base_dir is where #raw looks for files
+
+def transpile(source, fname=None, base_dir=None, **options):
+    if isinstance(source, str):
+        lines = source.splitlines(True)
+    else:
+        lines = list(source)
+
+    from . import pipeline
+
+    ctx = TranspileContext(**options)
+    return "\n".join(pipeline.pipeline(lines, base_dir, fname=fname, ctx=ctx))
+
+# one file transpile_project generated. line_map has the (source, line)
+# behind each line of text, or None for lines okp added
+class GeneratedFile(object):
+    def __init__(self, name, source, text, line_map):
+        self.name = name
+        self.source = source
+        self.text = text
+        self.line_map = line_map
+
+    def __repr__(self):
+        return "GeneratedFile(%r, source=%r)" % (self.name, self.source)
+
+# transpiles a project held in memory. files maps a path to its source, the
+# .cpy and .okp files are transpiled the way okp -t lays them out on disk
+# and every file can be pulled in with #raw. nothing is read from or
+# written to disk and the working directory is left alone:
+#
+#   out = okp.transpile_project({ "main.cpy": main, "util.cpy": util })
+#   out["main.cpp"].text
+#
+# returns generated path -> GeneratedFile
+def transpile_project(files, **options):
+    from . import project
+
+    base = TranspileContext(files=files, **options)
+    generated = {}
+    for path in sorted(files):
+        if not (path.endswith(".cpy") or path.endswith(".okp")):
+            continue
+
+        name = os.path.splitext(path)[0]
+        hfname, fname = "%s.h" % name, "%s.cpp" % name
+        ctx = base.fork()
+        line_maps = {}
+        h_lines, cpp_lines = project.transpile_lines(files[path].splitlines(True), path,
+            os.path.dirname(path) or ".", ctx, line_maps)
+
+        h_map, cpp_map = line_maps["h"], line_maps["cpp"]
+        if cpp_lines:
+            cpp_lines, cpp_map = project.wrap_impl(cpp_lines, cpp_map,
+                os.path.basename(hfname), ctx.project_impl_def)
+
+        outputs, _ = project.cpy_outputs(path, h_lines, h_map, cpp_lines, cpp_map, hfname, fname)
+        for out_path, lines, line_nos in outputs:
+            generated[out_path] = GeneratedFile(out_path, path, "\n".join(lines),
+                project.line_locations(path, lines, line_nos))
+
+    return generated
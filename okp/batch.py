@@ -0,0 +1,191 @@
+from __future__ import print_function
+
+import json
+import os
+import sys
+
+from . import config
+from . import util
+from .context import TranspileContext
+
+# okp --batch transpiles many independent snippets in one process. jobs
+# come in on stdin as json lines:
+#
+#   {"id": 1, "source": "int main():\n  print 1\n"}
+#
+# and every job gets one json line back on stdout, in the same order:
+#
+#   {"id": 1, "ok": true, "output": "...", "line_map": [...], "diagnostics": []}
+#
+# a job can also name its "fname" (used in #line directives, <stdin> by
+# default) and pass "options" for its TranspileContext on top of the
+# command line flags. when extract_impl splits a job, the impl half comes
+# back as "impl". diagnostics has the warnings okp printed while
+# transpiling the job. a job that fails has ok false and the reason at the
+# end of its diagnostics, the jobs after it still run.
+#
+# #raw only sees the files a job sends along in options["files"] (path ->
+# source), batch input never gets to read files off the disk.
+#
+# jobs are one-shot, so they skip the on disk transpile cache (nothing
+# would ever evict their entries). what carries over from job to job is
+# the warm interpreter and its split caches. with -j, jobs are spread
+# over worker processes and the results still come back in order
+
+# how many jobs each worker can have queued up
+QUEUE_DEPTH = 4
+
+def run_job(line, ctx):
+    from . import project
+
+    job = {}
+    messages = []
+    try:
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError("a job must be a json object")
+        if "source" not in job:
+            raise ValueError("job has no source")
+
+        source = job["source"]
+        fname = job.get("fname") or "<stdin>"
+        if job.get("options"):
+            options = dict(files={})
+            options.update(job["options"])
+            ctx = TranspileContext.from_config(**options)
+        else:
+            ctx = ctx.fork()
+
+        line_maps = {}
+        with util.collect_messages() as messages:
+            h_lines, cpp_lines = project.transpile_lines(source.splitlines(True), fname,
+                os.path.dirname(fname) or ".", ctx, line_maps)
+    except Exception as e:
+        return failed_result(job.get("id") if isinstance(job, dict) else None, e, messages)
+
+    result = {
+        "id": job.get("id"),
+        "ok": True,
+        "output": "\n".join(h_lines),
+        "line_map": line_maps.get("h", []),
+        "diagnostics": messages,
+    }
+    if cpp_lines:
+        result["impl"] = "\n".join(cpp_lines)
+        result["impl_line_map"] = line_maps.get("cpp", [])
+    return result
+
+def failed_result(job_id, e, messages=()):
+    return {
+        "id": job_id,
+        "ok": False,
+        "diagnostics": list(messages) + [ "%s: %s" % (type(e).__name__, e) ],
+    }
+
+# the id of the job on line, for results that never got to run_job
+def job_id(line):
+    try:
+        job = json.loads(line)
+    except ValueError:
+        return None
+    return job.get("id") if isinstance(job, dict) else None
+
+def write_result(out, result):
+    out.write(json.dumps(result) + "\n")
+    out.flush()
+
+def run_batch(jobs_in=None, out=None, jobs=1):
+    jobs_in = jobs_in or sys.stdin
+    out = out or sys.stdout
+    ctx = TranspileContext.from_config(files={})
+    lines = (line for line in jobs_in if line.strip())
+
+    try:
+        if jobs < 2:
+            for line in lines:
+                write_result(out, run_job(line, ctx))
+        else:
+            run_parallel(lines, out, jobs, ctx)
+    except BrokenPipeError:
+        # whoever read the results is gone (okp --batch | head). point out
+        # at /dev/null so flushing it at exit doesn't complain again
+        try:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+        except (AttributeError, ValueError, OSError):
+            pass
+
+# the jobs are read and handed to the pool on this thread while another
+# one writes the results as they finish, so a client can wait for each
+# result before sending its next job. if writing fails, the writer stops
+# and so does the reading, and the error is raised here.
+#
+# with fork, the pool starts all its workers on the first submit. the
+# writer thread is only started after that, so no worker is forked from
+# a process that has other threads running
+def run_parallel(lines, out, jobs, ctx):
+    from concurrent.futures import Future, ProcessPoolExecutor
+    import queue
+    import threading
+
+    from . import project
+
+    pending = queue.Queue(jobs * QUEUE_DEPTH)
+    stopped = threading.Event()
+    errors = []
+
+    def write_results():
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+
+                line, future = item
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # the job's worker died or the pool broke
+                    result = failed_result(job_id(line), e)
+                write_result(out, result)
+        except Exception as e:
+            errors.append(e)
+            stopped.set()
+
+    # a put that gives up once the writer has stopped, so we can't block
+    # on a full queue no one is reading anymore
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    writer = threading.Thread(target=write_results)
+
+    settings = dict((k, v) for k, v in vars(config).items() if k.isupper())
+    pool = ProcessPoolExecutor(max_workers=jobs,
+        initializer=project.init_transpile_worker, initargs=(settings,))
+    try:
+        for line in lines:
+            if stopped.is_set():
+                break
+
+            try:
+                future = pool.submit(run_job, line, ctx)
+            except Exception as e:
+                # a broken pool takes no more jobs, the rest fail the same way
+                future = Future()
+                future.set_exception(e)
+            put((line, future))
+            if writer.ident is None:
+                writer.start()
+    finally:
+        put(None)
+        if writer.ident is None:
+            writer.start()
+        writer.join()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,192 @@
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+from . import config
+from . import util
+
+# the on disk cache lives in ~/.cache/okp (or $XDG_CACHE_HOME/okp) unless
+# OKP_CACHE_DIR is set. each kind of entry gets its own subdirectory and
+# entries are sharded by the first two characters of their key
+def cache_dir(kind):
+    base = config.CACHE_DIR or os.environ.get("OKP_CACHE_DIR")
+    if not base:
+        xdg = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        base = os.path.join(xdg, "okp")
+
+    return os.path.join(base, kind)
+
+def entry_path(kind, key, ext):
+    return os.path.join(cache_dir(kind), key[:2], "%s%s" % (key, ext))
+
+def hash_parts(parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode("utf-8")
+        h.update(part)
+        h.update(b"\0")
+
+    return h.hexdigest()
+
+# hashes of the files object keys cover, keyed by path and build dir and
+# checked against the file's mtime and size, so a header that every object
+# includes is only read once
+FILE_HASHES = {}
+
+def file_hash(path, tmp_dir):
+    st = os.stat(path)
+    key = (os.path.abspath(path), tmp_dir)
+    stamp = (st.st_mtime_ns, st.st_size)
+    entry = FILE_HASHES.get(key)
+    if entry and entry[0] == stamp:
+        return entry[1]
+
+    with open(path) as f:
+        digest = hash_parts([ f.read().replace(tmp_dir, "<tmp>") ])
+
+    FILE_HASHES[key] = (stamp, digest)
+    return digest
+
+# the object key covers the generated C++ text, the local headers it
+# includes, the compiler (its path, mtime and size, see pch.compiler_id)
+# and the compile flags. paths inside the build dir are made relative,
+# since every run gets a fresh tmp dir. if a "quoted" header can't be
+# found next to its includer, we return None because we can't know what
+# the compiler will actually see
+def object_key(tmp_dir, fname, cxx, flags):
+    from collections import defaultdict
+
+    from . import analysis
+    from . import pch
+
+    graph = defaultdict(set)
+    analysis.walk_includes(fname, graph=graph)
+
+    files = set([ os.path.normpath(fname) ])
+    for included in graph.values():
+        files.update(included)
+
+    tmp_dir = os.path.abspath(tmp_dir)
+    parts = [ "object", cxx, pch.compiler_id(cxx), " ".join(flags) ]
+    try:
+        for path in sorted(files):
+            parts += [ os.path.abspath(path).replace(tmp_dir, "<tmp>"), file_hash(path, tmp_dir) ]
+    except (IOError, OSError):
+        return None
+
+    return hash_parts(parts)
+
+def fetch_object(key, ofname):
+    import shutil
+
+    path = entry_path("objects", key, ".o")
+    if not os.path.exists(path):
+        return False
+
+    try:
+        shutil.copyfile(path, ofname)
+        # bump the mtime so eviction treats this entry as recently used
+        os.utime(path, None)
+    except (IOError, OSError):
+        return False
+
+    return True
+
+# entries are written to a temporary name and renamed into place, so
+# concurrent builds never see a half written entry
+def store_entry(path, write):
+    import tempfile
+
+    dirname = os.path.dirname(path)
+    try:
+        os.makedirs(dirname)
+    except OSError:
+        pass
+
+    fd, tmp_path = tempfile.mkstemp(dir=dirname)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        util.verbose("couldn't store", path, "in cache")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def store_object(key, ofname):
+    import shutil
+
+    store_entry(entry_path("objects", key, ".o"),
+        lambda tmp_path: shutil.copyfile(ofname, tmp_path))
+
+# the transpile key covers the .cpy source, its path (it ends up in #line
+# directives), the options of the transpile context (including the
+# include inference tables) and the okp version. files that pull in other files
+# with #raw are never cached
+def transpile_key(fname, lines, ctx=None):
+    for line in lines:
+        if line.strip().startswith("#raw "):
+            return None
+
+    from .context import TranspileContext
+    from .version import __version__
+    flags = (ctx or TranspileContext.from_config()).options()
+    return hash_parts([ "transpile", __version__, fname, repr(flags) ] + lines)
+
+# line_maps are the source line numbers that project.process_file
+# fills in, they are stored with the transpile
+def fetch_transpiled(key, line_maps=None):
+    path = entry_path("transpile", key, ".json")
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        os.utime(path, None)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if line_maps is not None:
+        line_maps.update(entry.get("line_maps", {}))
+    return entry["h"], entry["cpp"]
+
+def store_transpiled(key, h_lines, cpp_lines, line_maps=None):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump({ "h": h_lines, "cpp": cpp_lines, "line_maps": line_maps or {} }, f)
+
+    store_entry(entry_path("transpile", key, ".json"), write)
+
+# removes the least recently used entries of `kind` until the total size
+# is under max_bytes
+def evict(kind, max_bytes=None):
+    if max_bytes is None:
+        max_bytes = config.CACHE_MAX_BYTES
+
+    entries = []
+    total = 0
+    for dirpath, _, filenames in os.walk(cache_dir(kind)):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+    if total <= max_bytes:
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+    util.verbose("evicted", kind, "cache down to", total, "bytes")
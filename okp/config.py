@@ -5,9 +5,27 @@ RUN_WITH_INPUT=False
 PRINT_ON_ERROR=False
 TRANSPILE_ONLY=False
 JOIN_ENDING_PERIODS=False
+ENABLE_FOR=False
+ENABLE_ROF=False
 COMPILER_FLAGS=[]
 LINT=False
 LINTERS=[]
 ADD_SOURCE_MAP=True
 PROJECT_IMPL_DEF="OKP_IMPL"
 EXTRACT_IMPL=False
+SPLIT_CACHE_SIZE=65536
+WATCH_INTERVAL=0.5
+PROFILE_PIPELINE=False
+PROFILE_JSON=None
+USE_CACHE=True
+INCLUDE_KEYWORDS={}
+USE_TRANSPILE_CACHE=True
+DECLARE_VARIABLES=True
+CACHE_DIR=None
+CACHE_MAX_BYTES=256 * 1024 * 1024
+SINGLE_HEADER_DEDUPE=False
+USE_PCH=False
+UNITY=False
+UNITY_UNITS=1
+SINGLE_HEADER_BANNERS=True
+COMPILE_TIMEOUT=None
@@ -0,0 +1,119 @@
+from __future__ import print_function
+
+import os
+
+from . import config
+
+# a TranspileContext holds what a transpile reads besides its source: the
+# options that change its output and the state that builds up while one
+# file is transpiled. pipeline.pipeline passes it down to the transforms
+# that need it, so transpiles running at the same time (in threads or in
+# a long lived process) don't share anything through globals.
+#
+# the command line options still live in config, from_config() makes a
+# context out of them
+
+class TranspileContext(object):
+    def __init__(self, enable_for=False, enable_rof=False, join_ending_periods=False,
+        declare_variables=True, add_source_map=True, extract_impl=False,
+        project_impl_def="OKP_IMPL", include_keywords=None, files=None):
+        from . import analysis
+
+        self.enable_for = enable_for
+        self.enable_rof = enable_rof
+        self.join_ending_periods = join_ending_periods
+        self.declare_variables = declare_variables
+        self.add_source_map = add_source_map
+        self.extract_impl = extract_impl
+        self.project_impl_def = project_impl_def
+
+        # header -> tokens that need it, on top of analysis.REQUIRE_KEYWORDS
+        self.require_keywords = analysis.REQUIRE_KEYWORDS
+        self.require_index = analysis.REQUIRE_INDEX
+        if include_keywords:
+            self.require_keywords = dict((h, list(t)) for h, t in analysis.REQUIRE_KEYWORDS.items())
+            for header, tokens in include_keywords.items():
+                analysis.add_include_keywords(self.require_keywords, header, tokens)
+            self.require_index = analysis.index_keywords(self.require_keywords)
+
+        self.define_keywords = analysis.DEFINE_KEYWORDS
+        self.define_index = analysis.DEFINE_INDEX
+
+        # path -> source of the files #raw can pull in. without it, #raw
+        # reads from the file system
+        self.files = None
+        if files is not None:
+            self.files = dict((os.path.normpath(path), source) for path, source in files.items())
+
+        # per transpile state
+        self.destructure_index = 0
+        self.destructure_tag = ""
+
+    @classmethod
+    def from_config(cls, **options):
+        settings = dict(
+            enable_for=config.ENABLE_FOR,
+            enable_rof=config.ENABLE_ROF,
+            join_ending_periods=config.JOIN_ENDING_PERIODS,
+            declare_variables=config.DECLARE_VARIABLES,
+            add_source_map=config.ADD_SOURCE_MAP,
+            extract_impl=config.EXTRACT_IMPL,
+            project_impl_def=config.PROJECT_IMPL_DEF,
+            include_keywords=config.INCLUDE_KEYWORDS,
+        )
+        settings.update(options)
+        return cls(**settings)
+
+    # a context with the same options and fresh state, for the next file
+    def fork(self):
+        ctx = TranspileContext.__new__(TranspileContext)
+        ctx.__dict__.update(self.__dict__)
+        ctx.destructure_index = 0
+        ctx.destructure_tag = ""
+        return ctx
+
+    def read_lines(self, path):
+        if self.files is None:
+            with open(path) as f:
+                return f.readlines()
+
+        path = os.path.normpath(path)
+        if path not in self.files:
+            raise IOError("no such file: %s" % path)
+        return self.files[path].splitlines(True)
+
+    # everything that changes the output, for cache keys
+    def options(self):
+        return [
+            self.enable_for,
+            self.enable_rof,
+            self.declare_variables,
+            self.join_ending_periods,
+            self.add_source_map,
+            self.extract_impl,
+            self.project_impl_def,
+            sorted(self.require_keywords.items()),
+            sorted(self.define_keywords.items()),
+        ]
+
+# a BuildContext holds the state of one build: its build dir, compiler and
+# flags, the precompiled header, what has been transpiled and written so
+# far and the results of its compiles. project's functions take one
+# instead of sharing module globals
+class BuildContext(object):
+    def __init__(self, tmp_dir, cxx=None, compile_flags=None, transpile=None):
+        self.tmp_dir = tmp_dir
+        self.cxx = cxx or os.environ.get("CXX", "g++")
+        self.compile_flags = compile_flags or []
+        self.transpile = transpile or TranspileContext.from_config()
+
+        # with --pch, the .cpp files okp generated (as opposed to .cpp
+        # files passed in) are compiled with pch_flags
+        self.pch_flags = []
+        self.pch_files = set()
+        # generated file -> the (source, line) behind each of its lines
+        self.line_maps = {}
+        # source -> (h_lines, cpp_lines, line_maps) from the transpile pool
+        self.transpiled = {}
+        # (source, runner.Result) for the compiles of the last compile_objects
+        self.compile_results = []
@@ -0,0 +1,48 @@
+from __future__ import print_function
+
+import os
+import re
+
+from . import runner
+
+# compiler diagnostics point at code as path:line: or path:line:col:, and
+# at includes as "In file included from path:line,". when a path is a file
+# okp generated, its line map says which .cpy line to point at instead.
+# this is what makes errors usable without #line directives
+LOCATION_RE = re.compile(r'([^\s:,"\'()]+):(\d+)(:\d+)?(?=[:,])')
+# "path: In function ..." headers have no line
+FILE_RE = re.compile(r'^([^\s:]+)(?=: )', re.MULTILINE)
+
+# line_maps maps a generated file's path to the (source, line) behind
+# each of its lines, or None for lines okp added
+def remap(text, line_maps):
+    if not line_maps:
+        return text
+
+    def lookup(path):
+        return line_maps.get(os.path.normpath(os.path.abspath(path)))
+
+    def replace(m):
+        locations = lookup(m.group(1))
+        line = int(m.group(2))
+        if not locations or line > len(locations) or not locations[line-1]:
+            return m.group(0)
+
+        source, line_no = locations[line-1]
+        return "%s:%s%s" % (source, line_no, m.group(3) or "")
+
+    def replace_file(m):
+        for location in lookup(m.group(1)) or []:
+            if location:
+                return location[0]
+        return m.group(0)
+
+    text = LOCATION_RE.sub(replace, text)
+    return FILE_RE.sub(replace_file, text)
+
+# an echo for runner that remaps diagnostics as they are printed
+def remapping_echo(line_maps):
+    def echo(data):
+        text = remap(data.decode("utf-8", "replace"), line_maps)
+        runner.echo_stderr(text.encode("utf-8"))
+    return echo
@@ -1,4 +1,5 @@
 from .util import *
+from . import lexer
 
 def is_identifier(w):
     if not w:
@@ -14,7 +15,7 @@ def is_identifier(w):
         
 def find_identifiers(line):
     seps = ",;.=->*+/()[]% "
-    return smart_split(line, seps, keep_splitters=True)
+    return lexer.split(line, seps, keep_splitters=True)
 
 # we do some touchups to remove something like foo.bar.baz
 # into only foo
@@ -0,0 +1,97 @@
+from __future__ import print_function
+
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate
+
+from . import config
+
+# a line is tokenized once into a compact token array. tokens are kept as
+# parallel tuples of their text and start offsets, and come in three kinds:
+#   words  - a run of letters, digits and underscores
+#   spaces - a run of spaces
+#   punct  - any other single character
+# separators are always punct or space characters, so a token's first
+# character is enough to tell whether it splits the line
+TOKEN_RE = re.compile(r"[A-Za-z0-9_]+| +|.", re.DOTALL)
+GROUP_RE = re.compile(r'["<>()]')
+
+# returns (texts, starts, jumps) for line. starts has one extra entry for
+# the end of the line. jumps maps the index of an opening '"', '<' or '('
+# token to the index just past its closer, using the same matching rules
+# as util.find_matching: quotes close at the next quote and brackets nest
+# (without regard to quotes)
+def tokenize_uncached(line):
+    texts = tuple(TOKEN_RE.findall(line))
+    starts = (0,) + tuple(accumulate(map(len, texts)))
+    jumps = {}
+
+    if GROUP_RE.search(line) is None:
+        return texts, starts, jumps
+
+    index_of = dict(zip(starts, range(len(texts))))
+    stacks = { '<': [], '(': [] }
+    quote = None
+    for m in GROUP_RE.finditer(line):
+        c = m.group(0)
+        index = index_of[m.start()]
+        if c == '"':
+            if quote is not None:
+                jumps[quote] = index + 1
+            quote = index
+        elif c in stacks:
+            stacks[c].append(index)
+        elif c == '>' and stacks['<']:
+            jumps[stacks['<'].pop()] = index + 1
+        elif c == ')' and stacks['(']:
+            jumps[stacks['('].pop()] = index + 1
+
+    return texts, starts, jumps
+
+tokenize = lru_cache(maxsize=config.SPLIT_CACHE_SIZE)(tokenize_uncached)
+
+def set_cache_size(maxsize):
+    global tokenize
+    tokenize = lru_cache(maxsize=maxsize)(tokenize_uncached)
+
+# splits line[start:end] on split_chars, keeping anything inside "", () and
+# <> together (unless the opener is itself a split char). this gives the
+# same pieces as splitting the sliced string, but shares one tokenization
+# of the line between all separator sets and offsets
+def split(line, split_chars, keep_splitters=False, start=0, end=None):
+    texts, starts, jumps = tokenize(line)
+    if end is None:
+        end = len(line)
+    if start >= end:
+        return []
+
+    i = bisect_left(starts, start)
+    n = bisect_left(starts, end)
+    if starts[i] != start or starts[n] != end:
+        # the slice cuts through a token, so it needs its own tokens
+        return split(line[start:end], split_chars, keep_splitters)
+
+    pieces = []
+    prev = []
+    while i < n:
+        t = texts[i]
+        if t[0] in split_chars:
+            if prev:
+                pieces.append(''.join(prev))
+                prev = []
+            if keep_splitters:
+                pieces.extend(t)
+            i += 1
+        elif i in jumps and jumps[i] <= n:
+            j = jumps[i]
+            prev.append(line[starts[i]:starts[j]])
+            i = j
+        else:
+            prev.append(t)
+            i += 1
+
+    if prev:
+        pieces.append(''.join(prev))
+
+    return pieces
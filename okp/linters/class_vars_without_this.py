@@ -19,12 +19,9 @@ import time
 from ..util import debug
 from .clanger import CI, get_idx
 
-FUNC = None
-CLASS = None
 ASSIGNMENT_FUNCS = [CI.CursorKind.BINARY_OPERATOR, CI.CursorKind.CALL_EXPR]
 REFERENCE_FUNCS = [ CI.CursorKind.MEMBER_REF_EXPR ]
 
-HAS_LINT_ISSUES=False
 def TOKENS(n):
     return [t.spelling for t in n.get_tokens()]
 
@@ -38,7 +35,9 @@ def get_path(node):
 
     return "%s|%s|" % (fname, ex.start.line)
 
-def validate(node):
+# state has the class and function we are in and whether we found issues,
+# one per lint_source_code call
+def validate(node, state):
     # debug(ds, node.kind)
     try:
         fname = node.extent.start.file.name
@@ -47,24 +46,23 @@ def validate(node):
     except:
         pass
 
-    global HAS_LINT_ISSUES, CLASS, FUNC
     kind = node.kind
     if node.kind == CI.CursorKind.CLASS_DECL:
-        CLASS = node.spelling
+        state["class"] = node.spelling
     elif node.kind == CI.CursorKind.CONSTRUCTOR:
-        FUNC = node.spelling
+        state["func"] = node.spelling
     elif node.kind == CI.CursorKind.CXX_METHOD:
-        FUNC = node.spelling
+        state["func"] = node.spelling
     elif node.kind in REFERENCE_FUNCS:
         tokens = TOKENS(node)
         if len(tokens) == 1:
             path = get_path(node)
-            HAS_LINT_ISSUES = True
+            state["issues"] = True
             debug("%s referencing '%s' in %s() of class %s without this->" %
-                   (path, tokens[0], FUNC, CLASS))
+                   (path, tokens[0], state["func"], state["class"]))
 
     for c in node.get_children():
-        validate(c)
+        validate(c, state)
 
 def lint_source_code(s):
     args = []
@@ -73,9 +71,10 @@ def lint_source_code(s):
     for d in list(tu.diagnostics):
         debug("DIAGNOSTIC:", d)
     # debug('Translation unit:', tu.spelling)
-    validate(tu.cursor)
+    state = { "class": None, "func": None, "issues": False }
+    validate(tu.cursor, state)
 
-    return HAS_LINT_ISSUES
+    return state["issues"]
 
 def find_instance_variable_assignment(fname):
     return lint_source_code(fname)
@@ -40,6 +40,40 @@ def get_parser():
         help="specify include guard to use")
     parser.add_argument('-sh', '--single-header', dest='single_header', action="store_true",
         help="transpile into a single header file")
+    parser.add_argument('-shd', '--dedupe-includes', dest='dedupe_includes', action="store_true",
+        help="with -sh, move <system> includes to the top of the header once each")
+    parser.add_argument('-shb', '--no-banners', dest='banners', action="store_false", default=True,
+        help="with -sh, leave out the FILE and REQUIRES comments")
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+        help="number of files to transpile and compile in parallel (0 uses every core)")
+    parser.add_argument('--compile-timeout', dest='compile_timeout', type=float, default=None,
+        help="give up on a compile that takes longer than this many seconds")
+    parser.add_argument('--split-cache-size', dest='split_cache_size', type=int, default=None,
+        help="how many lines the split caches hold (0 turns them off)")
+    parser.add_argument('-nc', '--no-cache', dest='use_cache', action="store_false",
+        help="don't reuse or store cached transpiles and objects", default=True)
+    parser.add_argument('--pch', dest='use_pch', action="store_true",
+        help="precompile the standard headers okp adds and use them for every file")
+    parser.add_argument('--unity', dest='unity', action="store_true",
+        help="compile the .cpp files together as one translation unit (files whose "
+        "file scope statics share a name are compiled on their own)")
+    parser.add_argument('--unity-units', dest='unity_units', type=int, default=1,
+        help="with --unity, split the files into this many translation units")
+    parser.add_argument('-w', '--watch', dest='watch', action="store_true",
+        help="rebuild whenever one of the files (or their includes) changes")
+    parser.add_argument('--server', dest='server', action="store_true",
+        help="stay running and serve builds requested by okpc")
+    parser.add_argument('--socket', dest='socket', default=None,
+        help="unix socket for --server and okpc to use (default $XDG_RUNTIME_DIR/okp-UID/okp.sock)")
+    parser.add_argument('--batch', dest='batch', action="store_true",
+        help="transpile the json lines jobs on stdin and write a json line result for each")
+    parser.add_argument('--profile-pipeline', dest='profile_pipeline', action="store_true",
+        help="print how long each transpile step takes (or set OKP_PROFILE_PIPELINE)")
+    parser.add_argument('--profile-json', dest='profile_json', default=None,
+        help="also write the pipeline profile to this json file (or set OKP_PROFILE_JSON)")
+    parser.add_argument('-ii', '--infer-include', dest='infer_includes', action="append", default=[],
+        metavar="HEADER=TOKENS", help="include HEADER in files that use one of the comma separated TOKENS, "
+        "like '<set>=set,multiset' (can be repeated)")
     parser.add_argument('-li', '--lint', dest='lint', action="store_true",
         help="run linters before compiling")
     parser.add_argument('-ns', '--no-source-map', dest='add_source_map', action="store_false",
@@ -52,16 +86,30 @@ def get_parser():
 def main():
     parser = get_parser()
     args, unknown = parser.parse_known_args()
-    if not args.files:
+    if args.server:
+        from .server import serve
+        serve(args.socket)
+        return
+
+    if not args.files and not args.batch:
         parser.print_help()
         return
 
     if args.disable_implication:
-        from .transforms import variables
-        variables.DECLARE_VARIABLES = False
+        config.DECLARE_VARIABLES = False
 
     config.LINT = args.lint
 
+    # header -> tokens on top of analysis.REQUIRE_KEYWORDS, for the
+    # TranspileContexts made from config
+    from . import analysis
+    config.INCLUDE_KEYWORDS = {}
+    for spec in args.infer_includes:
+        header, _, tokens = spec.partition("=")
+        if not header or not tokens:
+            parser.error("--infer-include expects HEADER=TOKENS, got %s" % spec)
+        analysis.add_include_keywords(config.INCLUDE_KEYWORDS, header, tokens.split(","))
+
     config.VERBOSE = args.verbose
 
     config.ENABLE_ROF = args.enable_rof
@@ -72,6 +120,27 @@ def main():
     config.RUN_WITH_INPUT = args.runinput
     config.ADD_SOURCE_MAP = args.add_source_map
     config.COMPILER_FLAGS = unknown
+    config.USE_CACHE = args.use_cache
+    config.COMPILE_TIMEOUT = args.compile_timeout
+    if args.split_cache_size is not None:
+        if args.split_cache_size < 0:
+            parser.error("--split-cache-size can't be negative")
+        config.SPLIT_CACHE_SIZE = args.split_cache_size
+        from . import util
+        util.apply_split_cache_size()
+    config.SINGLE_HEADER_DEDUPE = args.dedupe_includes
+    config.USE_PCH = args.use_pch
+    config.UNITY = args.unity
+    config.UNITY_UNITS = args.unity_units
+    config.SINGLE_HEADER_BANNERS = args.banners
+    config.PROFILE_JSON = args.profile_json or os.environ.get("OKP_PROFILE_JSON")
+    config.PROFILE_PIPELINE = args.profile_pipeline or bool(config.PROFILE_JSON) or \
+        bool(os.environ.get("OKP_PROFILE_PIPELINE"))
+    if config.PROFILE_PIPELINE:
+        # cached transpiles skip the pipeline, so there would be nothing to
+        # time. the object and pch caches stay on so compiles don't skew
+        # the timings
+        config.USE_TRANSPILE_CACHE = False
 
         
     if args.include_guard:
@@ -83,6 +152,16 @@ def main():
 
     config.TRANSPILE_ONLY = args.transpile
 
+    if args.batch:
+        from .batch import run_batch
+        run_batch(sys.stdin, sys.stdout, args.jobs or os.cpu_count() or 1)
+        return
+
+    if args.watch:
+        from .watch import watch_project
+        watch_project(args)
+        return
+
     from .project import compile_project
     compile_project(args)
 
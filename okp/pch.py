@@ -0,0 +1,106 @@
+from __future__ import print_function
+
+import os
+import re
+import shlex
+import shutil
+import subprocess
+
+from . import analysis
+from . import cache
+from . import config
+from . import util
+
+# with --pch, the standard headers that okp adds to generated files
+# (<iostream>, <vector>, ...) are compiled once into a precompiled header
+# and every generated .cpp is compiled with -include okp_pch.h, so g++
+# loads the .gch instead of parsing those headers for each file. a .gch
+# only works with the compiler and flags that built it, so they are part
+# of its cache key
+
+PCH_NAME = "okp_pch.h"
+INCLUDE_RE = re.compile(r"^#include (<[^>\n]+>)", re.MULTILINE)
+
+# the union of the inferred includes that fnames use
+def inferred_includes(fnames):
+    includes = set()
+    for fname in fnames:
+        try:
+            with open(fname) as f:
+                text = f.read()
+        except (IOError, OSError):
+            continue
+
+        for include in INCLUDE_RE.findall(text):
+            if include in analysis.REQUIRE_KEYWORDS:
+                includes.add(include)
+
+    return sorted(includes)
+
+# upgrading the compiler in place keeps its path, so its size and mtime
+# stand in for its version
+def compiler_id(cxx):
+    parts = []
+    for part in shlex.split(cxx):
+        path = shutil.which(part)
+        if path:
+            st = os.stat(path)
+            parts.append("%s:%s:%s" % (path, st.st_mtime, st.st_size))
+        else:
+            parts.append(part)
+
+    return " ".join(parts)
+
+def pch_key(cxx, flags, includes):
+    return cache.hash_parts([ "pch", cxx, compiler_id(cxx), " ".join(flags) ] + includes)
+
+def build(out_dir, cxx, flags, includes):
+    header = os.path.join(out_dir, PCH_NAME)
+
+    def write_header(tmp_path):
+        with open(tmp_path, "w") as f:
+            f.write("// generated by okp --pch\n")
+            for include in includes:
+                f.write("#include %s\n" % include)
+
+    cache.store_entry(header, write_header)
+
+    # like cache entries, the .gch is built under a temporary name and
+    # renamed into place
+    gch = header + ".gch"
+    tmp_path = "%s.%s.tmp" % (gch, os.getpid())
+    cmd = shlex.split(cxx) + [ "-x", "c++-header", header, "-o", tmp_path ] + flags
+    util.debug(" ".join(cmd))
+    try:
+        subprocess.check_call(cmd)
+        os.replace(tmp_path, gch)
+    except (subprocess.CalledProcessError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    return True
+
+# returns the flags that make a compile use the precompiled header for
+# the includes of fnames, building it if needed. if there is nothing to
+# precompile or the build fails, files are compiled without one
+def prepare(tmp_dir, fnames, cxx, flags):
+    includes = inferred_includes(fnames)
+    if not includes:
+        return []
+
+    if config.USE_CACHE:
+        key = pch_key(cxx, flags, includes)
+        out_dir = os.path.join(cache.cache_dir("pch"), key[:2], key)
+    else:
+        out_dir = os.path.join(tmp_dir, "pch")
+
+    header = os.path.join(out_dir, PCH_NAME)
+    if os.path.exists(header) and os.path.exists(header + ".gch"):
+        util.verbose("using precompiled header", header)
+        os.utime(header + ".gch", None)
+    elif not build(out_dir, cxx, flags, includes):
+        util.debug("couldn't build precompiled header, compiling without it")
+        return []
+
+    return [ "-include", header ]
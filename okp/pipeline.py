@@ -1,85 +1,166 @@
 from __future__ import print_function
 from .transforms import comments, io, keywords, structure, variables
 from . import analysis
+from .context import TranspileContext
+from . import profiler
 from . import util
 
 import os
 
 ASSERT_SOURCE_MAP = True
 
-def pipeline(lines, base_dir=None, add_source_map=True, fname=None):
-    lines = comments.skip_comments(lines)
+# runs every line through each of the steps in turn, so a group of
+# line local transforms only needs one pass over the file
+def map_lines(lines, steps):
+    for line in lines:
+        for step in steps:
+            line = step(line)
+        yield line
+
+LINE_STEPS = [
+    keywords.replace_tabs_line,
+    keywords.replace_pass_line,
+    keywords.replace_for_shorthand_line,
+    keywords.replace_blocks_line,
+    keywords.replace_defs_line,
+    keywords.replace_self_line,
+    # replaces !, ?, ??, print, read, etc
+    io.replace_io_line,
+    variables.replace_walrus_line,
+]
+
+# known keyword replacement has to happen after auto declarations
+POST_DECLARATION_STEPS = [
+    keywords.replace_knowns_line,
+    structure.add_parentheses_line,
+]
+
+# a stage turns a stream of lines into another stream. when profiling,
+# every stage is run to completion on its own so it can be timed
+def run_stages(lines, stages):
+    if not profiler.enabled():
+        for name, stage in stages:
+            lines = stage(lines)
+        return list(lines)
+
+    lines = list(lines)
+    for name, stage in stages:
+        lines = profiler.call(name, lambda lines: list(stage(lines)), lines)
+    return lines
+
+# steps in CONTEXT_STEPS are called as step(line, ctx)
+CONTEXT_STEPS = set([ keywords.replace_for_shorthand_line ])
+
+def with_context(steps, ctx):
+    bound = []
+    for step in steps:
+        if step in CONTEXT_STEPS:
+            def bound_step(line, step=step):
+                return step(line, ctx)
+            bound_step.__name__ = step.__name__
+            step = bound_step
+        bound.append(step)
+    return bound
+
+def line_stages(steps):
+    if profiler.enabled():
+        return [ (step.__name__, lambda lines, step=step: map_lines(lines, [ step ]))
+            for step in steps ]
+
+    return [ ("line steps", lambda lines: map_lines(lines, steps)) ]
+
+def add_required_files(lines, ctx=None):
+    return analysis.guess_required_files(lines, ctx) + lines
+
+# GCC / MSVCC directive for #line is:
+# #line <line> "<file>"
+# we only label lines if their labeling is off from what
+# we expect so we don't bloat our output files up
+def add_line_directives(lines, line_nos, fname, line_map=None):
+    new_lines = []
+    cur_line = 0
+    for line_no, line in zip(line_nos, lines):
+        if cur_line != line_no:
+            new_lines.append("#line %s" % line_no)
+            if line_map is not None:
+                line_map.append(0)
+        new_lines.append(line)
+        if line_map is not None:
+            line_map.append(line_no)
+        cur_line = line_no
+        cur_line += 1
+
+    if fname:
+        new_lines = ['#line 0 "%s"' % fname] + new_lines
+        if line_map is not None:
+            line_map.insert(0, 0)
+    return new_lines
+
+# if line_map is a list, it gets the source line number of each returned
+# line, 0 for lines okp added. it is left empty if the transforms changed
+# the line count and the lines can't be matched up.
+#
+# ctx is the context.TranspileContext with the options to transpile with,
+# by default one is made from config. add_source_map overrides its
+# add_source_map
+def pipeline(lines, base_dir=None, add_source_map=None, fname=None, line_map=None, ctx=None):
+    if ctx is None:
+        ctx = TranspileContext.from_config()
+    if add_source_map is None:
+        add_source_map = ctx.add_source_map
+
+    if fname:
+        ctx.destructure_tag = variables.destructure_tag(fname)
+
+    profiler.start_file()
+    lines = profiler.call("skip_comments", comments.skip_comments, lines)
     # all functions modifying tlines can change the line numbers
     # of the source code by removing or adding new lines
     tlines = [(i+1, line) for i, line in enumerate(lines)]
-    tlines = structure.join_backslash_lines(tlines)
-    tlines = structure.join_open_bracketed_lines(tlines)
-    tlines = structure.join_percent_bracketed_lines(tlines)
-    tlines = structure.fix_dangling_hash_lines(tlines)
+    tlines = profiler.call("join_backslash_lines", structure.join_backslash_lines, tlines, ctx)
+    tlines = profiler.call("join_open_bracketed_lines", structure.join_open_bracketed_lines, tlines)
+    tlines = profiler.call("join_percent_bracketed_lines", structure.join_percent_bracketed_lines, tlines)
+    tlines = profiler.call("fix_dangling_hash_lines", structure.fix_dangling_hash_lines, tlines)
 
     lines = [line for line_no, line in tlines]
     line_nos = [line_no for line_no, _ in tlines]
     num_lines = len(lines)
 
-    def runner(lines):
-        def run(step, *args):
-            new_lines = step(lines, *args)
-            if add_source_map and ASSERT_SOURCE_MAP:
-                assert(len(new_lines) == num_lines)
+    def check(new_lines):
+        if add_source_map and ASSERT_SOURCE_MAP:
+            assert(len(new_lines) == num_lines)
+        return new_lines
 
-            del lines[:]
-            lines.extend(new_lines)
-            return lines
+    # the steps are chained generators, the file is only held as a list
+    # for add_auto_declarations (which needs every line's scope) and at
+    # the end
+    lines = check(run_stages(lines, [
+        ("add_preceding_ignore_chars", structure.iter_preceding_ignore_chars),
+        ("replace_raw", lambda lines: keywords.iter_raw(lines, base_dir or os.getcwd(), ctx)),
+    ] + line_stages(with_context(LINE_STEPS, ctx))))
 
-        return run
+    # scopings is a per line scope of seen variables
+    lines = check(profiler.call("add_auto_declarations", variables.add_auto_declarations, lines, ctx))
 
-    run = runner(lines)
-    run(structure.add_preceding_ignore_chars)
-    run(keywords.replace_raw, base_dir or os.getcwd())
-    run(keywords.replace_tabs)
-    run(keywords.replace_pass)
-    run(keywords.replace_for_shorthand)
-    run(keywords.replace_blocks)
-    run(keywords.replace_defs)
-    run(keywords.replace_self)
+    lines = check(run_stages(lines, line_stages(POST_DECLARATION_STEPS) + [
+        ("add_trailing_semicolons", structure.iter_trailing_semicolons),
+        # add curly braces (from indentation) has to be last
+        ("add_curly_braces", structure.iter_curly_braces),
+        # TODO: decide on whether to remove from generated code or not
+    ] + line_stages([ structure.remove_preceding_ignore_chars_line ])))
 
-    # replaces !, ?, ??, print, read, etc
-    run(io.replace_io_keywords)
-    # scopings is a per line scope of seen variables
-    run(variables.replace_walrus_operator)
-    run(variables.add_auto_declarations)
-    # known keyword replacement has to happen after auto declarations
-    run(keywords.replace_knowns)
-    run(structure.add_parentheses)
-    run(structure.add_trailing_semicolons)
-    # add curly braces (from indentation) has to be last
-    run(structure.add_curly_braces)  # can change line numbers
-    # TODO: decide on whether to remove from generated code or not
-    run(structure.remove_preceding_ignore_chars)
-
-    requires = analysis.guess_required_files(lines)
-    lines = requires + lines
+    num_lines = len(lines)
+    lines = profiler.call("guess_required_files", add_required_files, lines, ctx)
+    num_requires = len(lines) - num_lines
 
     if add_source_map and ASSERT_SOURCE_MAP:
-        line_nos = [0]*len(requires)+line_nos
+        line_nos = [0]*num_requires+line_nos
         assert(len(line_nos) == len(lines))
 
-        tlines = zip(line_nos, lines)
-        new_lines = []
-        cur_line = 0
-        # GCC / MSVCC directive for #line is:
-        # #line <line> "<file>"
-        # we only label lines if their labeling is off from what
-        # we expect so we don't bloat our output files up
-        for line_no, line in tlines:
-            if cur_line != line_no:
-                new_lines.append("#line %s" % line_no)
-            new_lines.append(line)
-            cur_line = line_no
-            cur_line += 1
-
-        if fname:
-            new_lines = ['#line 0 "%s"' % fname] + new_lines
-        return new_lines
-    else:
-        return lines
+        lines = profiler.call("add_line_directives", add_line_directives, lines, line_nos, fname,
+            line_map)
+    elif line_map is not None and num_requires + len(line_nos) == len(lines):
+        line_map.extend([0]*num_requires+line_nos)
+
+    profiler.finish_file(fname)
+    return lines
@@ -0,0 +1,84 @@
+from __future__ import print_function
+
+import json
+import sys
+import time
+
+from . import config
+
+# when config.PROFILE_PIPELINE is on, pipeline steps are timed through
+# call(). stats map a step name to its wall time (excluding any steps it
+# called itself), call count and the change in line count it caused.
+# FILE_STATS covers the file being transpiled, TOTAL_STATS the whole run
+FILE_STATS = {}
+TOTAL_STATS = {}
+FILES = {}
+
+# time spent in nested calls, one entry per call in progress
+NESTED = []
+
+def enabled():
+    return config.PROFILE_PIPELINE
+
+def record(stats, name, seconds, calls=1, lines=0):
+    entry = stats.setdefault(name, { "seconds": 0.0, "calls": 0, "lines": 0 })
+    entry["seconds"] += seconds
+    entry["calls"] += calls
+    entry["lines"] += lines
+
+def call(name, func, *args):
+    if not enabled():
+        return func(*args)
+
+    NESTED.append(0.0)
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = NESTED.pop()
+        if NESTED:
+            NESTED[-1] += elapsed
+
+    lines = 0
+    if isinstance(result, list) and args and isinstance(args[0], list):
+        lines = len(result) - len(args[0])
+
+    for stats in (FILE_STATS, TOTAL_STATS):
+        record(stats, name, elapsed - nested, 1, lines)
+    return result
+
+def start_file():
+    FILE_STATS.clear()
+
+def finish_file(fname):
+    if not enabled():
+        return
+
+    print_report(FILE_STATS, "pipeline profile for %s" % fname)
+    stats = FILES.setdefault(fname, {})
+    for name, entry in FILE_STATS.items():
+        record(stats, name, entry["seconds"], entry["calls"], entry["lines"])
+
+def print_report(stats, title):
+    total = sum(entry["seconds"] for entry in stats.values())
+    print(title, file=sys.stderr)
+    print("  %9s %6s %6s %8s  %s" % ("seconds", "%", "calls", "lines", "step"), file=sys.stderr)
+    for name, entry in sorted(stats.items(), key=lambda kv: -kv[1]["seconds"]):
+        pct = 100.0 * entry["seconds"] / total if total else 0
+        print("  %9.4f %6.1f %6d %+8d  %s" % (entry["seconds"], pct, entry["calls"],
+            entry["lines"], name), file=sys.stderr)
+    print("  %9.4f total" % total, file=sys.stderr)
+
+def finish_project(json_path=None):
+    if not enabled():
+        return
+
+    if len(FILES) > 1:
+        print_report(TOTAL_STATS, "pipeline profile for all files")
+
+    if json_path:
+        from .version import __version__
+        with open(json_path, "w") as f:
+            json.dump({ "version": __version__, "files": FILES, "total": TOTAL_STATS },
+                f, indent=2, sort_keys=True)
@@ -1,20 +1,20 @@
 from __future__ import print_function
-from future.utils import raise_
 
 import re
 import os
-import tempfile
-import shutil
-import shlex
-import subprocess
 import sys
 
-from . import pipeline
+from . import cache
+from . import profiler
 from . import analysis
 from . import util
 from . import config
-from . import single_header
-from . import linters
+from .context import BuildContext, TranspileContext
+
+# the transforms, the compile machinery (runner, pch, unity, single_header,
+# diagnostics) and the linters are imported where they are used, so that
+# okp -p doesn't load what only compiles need and okp file.cpp doesn't
+# load the transforms
 
 CXX = os.environ.get("CXX", "g++")
 
@@ -56,10 +56,14 @@ def check_for_impl(lines):
 
 # this function extracts lines like:
 # `static int foo = 1` and `extern int foo = 1`
-def extract_impl(lines):
+# if line_nos is a dict, its "h" and "cpp" entries get the line number
+# each returned line came from (0 for added lines). without split, the
+# extracted lines are put back at the end of the header
+def extract_impl(lines, line_nos=None, split=True):
     class_stack = []
     ns_stack = []
     h_lines, cpp_lines = [],[]
+    h_nos, cpp_nos = [],[]
     i = 0
     namespace_indent = 0
     has_hidden = False
@@ -67,6 +71,8 @@ def extract_impl(lines):
     # need to keep track of namespace indenting AND class indenting
     has_hidden = check_for_impl(lines)
     if not has_hidden:
+        if line_nos is not None:
+            line_nos.update(h=list(range(1, len(lines)+1)), cpp=[])
         return lines, []
 
     open_namespace = 0
@@ -82,12 +88,14 @@ def extract_impl(lines):
             found_keyword = False
             for d in ["extern ", "static "]:
                 if line.strip().startswith(d):
-                    parts = util.smart_split(line, '=')
+                    parts = list(util.smart_split(line, '='))
                     parts[0] = parts[0].replace(d, "")
                     if len(parts) == 1:
                         h_lines.append(" " * indent + d + parts[0].strip() + "\n")
+                        h_nos.append(i+1)
                     elif len(parts) == 2:
                         h_lines.append(" " * indent + d + parts[0].strip() + "\n")
+                        h_nos.append(i+1)
                         # the prefix is basically the class list
                         if class_stack:
                             prefix = "::".join(map(lambda w: w[1], class_stack)) + "::"
@@ -99,6 +107,7 @@ def extract_impl(lines):
                             tokens[-1] + "=" + parts[1] + "\n"
                         # print("NEW LINE", class_stack, new_line, file=sys.stderr)
                         cpp_lines.append(new_line)
+                        cpp_nos.append(i+1)
                     else:
                         raise Exception(line.strip() + " IS AN INVALID GLOBAL LINE")
 
@@ -127,65 +136,110 @@ def extract_impl(lines):
             ns_stack.append((indent, line.lstrip()))
 
             cpp_lines.append(" " * namespace_indent + line.lstrip())
+            cpp_nos.append(i+1)
             namespace_indent += 2
             open_namespace = namespace_indent
 
         h_lines.append(line)
+        h_nos.append(i+1)
         i += 1
 
     if open_namespace > 0:
         cpp_lines.append(" " * open_namespace + "")
+        cpp_nos.append(0)
 
 
-    if config.EXTRACT_IMPL:
+    if split:
+        if line_nos is not None:
+            line_nos.update(h=h_nos, cpp=cpp_nos)
         return h_lines, cpp_lines
     else:
         h_lines.append("\n")
         h_lines.extend(cpp_lines)
+        if line_nos is not None:
+            line_nos.update(h=h_nos + [0] + cpp_nos, cpp=[])
         return h_lines, []
 
-def process_file(fname):
+# if line_maps is a dict, its "h" and "cpp" entries get the source line
+# number behind each transpiled line (0 for lines okp added). the file is
+# transpiled with a fresh copy of ctx (a context.TranspileContext), so its
+# output doesn't depend on the files transpiled before it
+def process_file(fname, line_maps=None, ctx=None):
     basedir, name = os.path.split(fname)
     with open(fname) as f:
         lines = f.readlines()
 
-    if config.EXTRACT_IMPL:
-        h_lines, cpp_lines = extract_impl(lines)
+    if line_maps is None:
+        line_maps = {}
+    ctx = ctx.fork() if ctx else TranspileContext.from_config()
+    return cached_transpile(lines, os.path.normpath(os.path.abspath(fname)), basedir, ctx, line_maps)
+
+# transpile_lines, going through the transpile cache unless it is turned off
+def cached_transpile(lines, fname, basedir, ctx, line_maps):
+    key = None
+    if config.USE_CACHE and config.USE_TRANSPILE_CACHE:
+        key = cache.transpile_key(fname, lines, ctx)
+        cached = key and cache.fetch_transpiled(key, line_maps)
+        if cached:
+            util.verbose("using cached transpile for", fname)
+            return cached
+
+    h_lines, cpp_lines = transpile_lines(lines, fname, basedir, ctx, line_maps)
+    if key:
+        cache.store_transpiled(key, h_lines, cpp_lines, line_maps)
+    return h_lines, cpp_lines
+
+# the part of process_file that only works on lines, without the cache or
+# the file system (unless the source uses #raw). fname is what the #line
+# directives name
+def transpile_lines(lines, fname, basedir, ctx, line_maps):
+    line_nos = {}
+    if ctx.extract_impl:
+        h_lines, cpp_lines = extract_impl(lines, line_nos)
     else:
         h_lines, cpp_lines = lines, []
+        line_nos.update(h=list(range(1, len(lines)+1)), cpp=[])
 
-    add_source_map = config.ADD_SOURCE_MAP
+    add_source_map = ctx.add_source_map
     if cpp_lines:
         add_source_map = False
 
-    fname = os.path.normpath(os.path.abspath(fname))
+    # the pipeline numbers the lines it was given, which extract_impl may
+    # have taken from anywhere in the file
+    def source_lines(kind, line_map):
+        nos = line_nos[kind]
+        return [ nos[n-1] if 0 < n <= len(nos) else 0 for n in line_map ]
+
+    from . import pipeline
+
+    h_map, cpp_map = [], []
     h_lines = pipeline.pipeline(
         h_lines, basedir, fname=fname,
-        add_source_map=add_source_map)
+        add_source_map=add_source_map, line_map=h_map, ctx=ctx)
     if cpp_lines:
         cpp_lines = pipeline.pipeline(
             cpp_lines, basedir, fname=fname,
-            add_source_map=add_source_map)
+            add_source_map=add_source_map, line_map=cpp_map, ctx=ctx)
 
+    line_maps.update(h=source_lines("h", h_map), cpp=source_lines("cpp", cpp_map))
     return h_lines, cpp_lines
 
 def run_cmd(cmd, more_args=[], stdin=None):
+    import shlex
+    from . import runner
+
     cmd_args = shlex.split(cmd)
     cmd_args.extend(more_args)
     util.debug(" ".join(cmd_args))
 
     if stdin:
-        pipe = subprocess.Popen(cmd_args, stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = pipe.communicate(bytes(stdin))
+        result = runner.run(cmd_args, stdin=stdin.encode("utf-8"))
+        return result.stdout
 
-        if stderr:
-            print(stderr, file=sys.stderr)
-        return stdout or ""
+    return runner.run(cmd_args).check().stdout
 
-    return subprocess.check_output(cmd_args)
-
-def process_h_file(tmp_dir, arg):
+def process_h_file(build, arg):
+    tmp_dir = build.tmp_dir
     name = arg
     fname = os.path.join(tmp_dir, arg)
     basedir = os.path.dirname(fname)
@@ -205,6 +259,7 @@ def process_h_file(tmp_dir, arg):
 
     with open(fname, "w") as f:
         f.write("".join(lines))
+    record_copy(build, fname, arg, lines)
 
     return
 
@@ -218,26 +273,121 @@ def print_file_with_line_nums(fname):
         util.debug(i, line.rstrip())
     util.debug("")
 
-def compile_cpy_file(tmp_dir, arg):
-    name, ext = os.path.splitext(arg)
-    fname = os.path.join(tmp_dir, "%s.cpp" % name)
-    return compile_cpp_file(tmp_dir, fname)
-
-def compile_cpp_file(tmp_dir, arg):
+# build.line_maps maps each file written into tmp_dir to the (source,
+# line) behind each of its lines (None for lines okp added), so compiler
+# diagnostics that point into tmp_dir can be pointed back at the sources.
+#
+# lines are written joined by newlines, line_nos has the source line of
+# each one. if they don't line up, the file is left unmapped
+def record_line_map(build, path, source, lines, line_nos):
+    path = os.path.normpath(os.path.abspath(path))
+    locations = line_locations(source, lines, line_nos)
+    if locations is None:
+        build.line_maps.pop(path, None)
+    else:
+        build.line_maps[path] = locations
+
+def line_locations(source, lines, line_nos):
+    if len(lines) != len(line_nos):
+        return None
+
+    locations = []
+    for line, line_no in zip(lines, line_nos):
+        location = (source, line_no) if line_no else None
+        locations.extend([ location ] * (line.count("\n") + 1))
+    return locations
+
+# a source copied into tmp_dir as is
+def record_copy(build, path, source, lines):
+    source = os.path.normpath(os.path.abspath(source))
+    build.line_maps[os.path.normpath(os.path.abspath(path))] = \
+        [ (source, i+1) for i in range(len(lines)) ]
+
+class BuildFailed(Exception):
+    def __init__(self, fnames, results=[]):
+        Exception.__init__(self, "Couldn't compile %s" % ", ".join(fnames))
+        self.fnames = fnames
+        self.results = results
+
+# returns the source that arg compiles from, its .o file and the command
+# that compiles it, which is None if the object is already there. the
+# cache key comes back too, so the object can be stored once it is built
+def compile_command(build, arg):
+    tmp_dir = build.tmp_dir
+    if arg.endswith(".o"):
+        return arg, arg, None, None
+    if not arg.endswith((".cpy", ".okp", ".cpp", ".c")):
+        return arg, None, None, None
+
+    # .cpy files were transpiled and .c files copied into tmp_dir as .cpp
     name, ext = os.path.splitext(arg)
     fname = os.path.join(tmp_dir, "%s.cpp" % name)
     ofname = os.path.join(tmp_dir, "%s.o" % name)
+    flags = build.compile_flags
+    if os.path.normpath(fname) in build.pch_files:
+        flags = build.compile_flags + build.pch_flags
+
+    import shlex
+
+    key = None
+    if config.USE_CACHE:
+        key = cache.object_key(tmp_dir, fname, build.cxx, flags)
+        if key and cache.fetch_object(key, ofname):
+            util.verbose("using cached object for", fname)
+            return fname, ofname, None, None
+
+    return fname, ofname, shlex.split(build.cxx) + [ "-c", fname, "-o", ofname ] + flags, key
+
+def report_compiles(results):
+    if not results or not config.VERBOSE:
+        return
+
+    total = sum(result.duration for fname, result in results)
+    util.verbose("compiled %s files, %.2fs of compiler time" % (len(results), total))
+    for fname, result in sorted(results, key=lambda r: -r[1].duration)[:5]:
+        util.verbose("  %6.2fs %s" % (result.duration, fname))
+
+# compiles each file into a .o file, running up to `jobs` compiles at
+# once. every file is attempted before we report failures, so one bad
+# file doesn't hide errors in the others. the .o files come back in the
+# same order as their sources. the results of the compiles are kept in
+# build.compile_results as (source, runner.Result) pairs
+def compile_objects(build, files, jobs=1):
+    from . import diagnostics
+    from . import runner
+
+    files = [ f for f in files if f != '-' ]
+    ofiles = []
+    commands = []
+    for arg in files:
+        fname, ofname, cmd_args, key = compile_command(build, arg)
+        ofiles.append(ofname)
+        if cmd_args:
+            commands.append((fname, ofname, cmd_args, key))
+
+    results = runner.run_many([ cmd_args for fname, ofname, cmd_args, key in commands ],
+        jobs, config.COMPILE_TIMEOUT, diagnostics.remapping_echo(build.line_maps))
+    build.compile_results = [ (command[0], result) for command, result in zip(commands, results) ]
+
+    failed = []
+    for (fname, ofname, cmd_args, key), result in zip(commands, results):
+        if result.ok:
+            if key:
+                cache.store_object(key, ofname)
+            continue
 
-    try:
-        run_cmd("%s -c '%s' -o '%s' " % (CXX, fname, ofname), COMPILE_FLAGS)
-    except:
         if config.PRINT_ON_ERROR:
             print_file_with_line_nums(fname)
+        failed.append((fname, result))
 
-        e = sys.exc_info()
-        print("Couldn't compile", fname, "aborting")
-        sys.exit(1)
-    return ofname
+    report_compiles(build.compile_results)
+    if failed:
+        for fname, result in failed:
+            print("Couldn't compile", fname)
+            util.debug("%s: %s" % (fname, result.describe()))
+        raise BuildFailed([ fname for fname, result in failed ], failed)
+
+    return [ f for f in ofiles if f ]
 
 
 def add_guards(arg, lines):
@@ -256,7 +406,8 @@ def add_guards(arg, lines):
 
     return lines
 
-def process_cpp_file(args, tmp_dir, arg):
+def process_cpp_file(args, build, arg):
+    tmp_dir = build.tmp_dir
     name, ext = os.path.splitext(arg)
     fname = os.path.join(tmp_dir, "%s.cpp" % name)
     ofname = os.path.join(tmp_dir, "%s.o" % name)
@@ -279,31 +430,56 @@ def process_cpp_file(args, tmp_dir, arg):
 
     with open(fname, "w") as f:
         f.write("".join(lines))
+    record_copy(build, fname, arg, lines)
 
     return ofname
 
 
 
-def process_cpy_file(args, tmp_dir, arg, use_headers=False):
+# the .cpp half of a file split by extract_impl only builds with
+# impl_def defined
+def wrap_impl(cpp_lines, cpp_map, hfname, impl_def):
+    new_cpp_lines = ["#ifdef %s" % (impl_def), '#include "{}"'.format(hfname)]
+    new_cpp_lines.extend(cpp_lines)
+    new_cpp_lines.append("#endif /* %s */ \n" % impl_def)
+    return new_cpp_lines, [0, 0] + cpp_map + [0]
+
+# the files a transpiled .cpy turns into, as (path, lines, line_nos), and
+# the one of them to compile (None for a plain header). a file without
+# main becomes a header with include guards
+def cpy_outputs(arg, h_lines, h_map, cpp_lines, cpp_map, hfname, fname):
+    has_main = analysis.file_contains_main(h_lines)
+    if not has_main:
+        outputs = [ (hfname, add_guards(arg, list(h_lines)), [0] + h_map + [0]) ]
+        if cpp_lines:
+            outputs.append((fname, cpp_lines, cpp_map))
+    elif cpp_lines:
+        outputs = [ (hfname, h_lines, h_map), (fname, cpp_lines, cpp_map) ]
+    else:
+        outputs = [ (fname, h_lines, h_map) ]
+
+    compiled = fname if has_main or cpp_lines else None
+    return outputs, compiled
+
+def process_cpy_file(args, build, arg, use_headers=False):
+    tmp_dir = build.tmp_dir
     name, ext = os.path.splitext(arg)
     fname = os.path.join(tmp_dir, "%s.cpp" % name)
     ofname = os.path.join(tmp_dir, "%s.o" % name)
     hfname = os.path.join(tmp_dir, "%s.h" % name)
 
-    h_lines, cpp_lines = process_file(arg)
+    if arg in build.transpiled:
+        h_lines, cpp_lines, line_maps = build.transpiled.pop(arg)
+    else:
+        line_maps = {}
+        h_lines, cpp_lines = process_file(arg, line_maps, build.transpile)
+    h_map, cpp_map = line_maps.get("h", []), line_maps.get("cpp", [])
     if cpp_lines:
-        new_cpp_lines = ["#ifdef %s" % (config.PROJECT_IMPL_DEF), '#include "{}"'.format(hfname)]
-        new_cpp_lines.extend(cpp_lines)
-        new_cpp_lines.append("#endif /* %s */ \n" % config.PROJECT_IMPL_DEF)
-        cpp_lines = new_cpp_lines
-
-    as_header = True
-    added = False
-    if analysis.file_contains_main(h_lines):
-        as_header = False
-        args.files.append(fname)
-        added = True
+        cpp_lines, cpp_map = wrap_impl(cpp_lines, cpp_map, hfname, build.transpile.project_impl_def)
 
+    outputs, compiled = cpy_outputs(arg, h_lines, h_map, cpp_lines, cpp_map, hfname, fname)
+    if compiled:
+        args.files.append(compiled)
 
     basedir = os.path.dirname(fname)
 
@@ -318,60 +494,111 @@ def process_cpy_file(args, tmp_dir, arg, use_headers=False):
         print_lines(cpp_lines)
         return
 
-    if as_header:
-        header = h_lines
-        header = add_guards(arg, header)
+    source = os.path.normpath(os.path.abspath(arg))
+    for path, lines, line_nos in outputs:
+        with open(path, "w") as f:
+            f.write("\n".join(lines))
+        record_line_map(build, path, source, lines, line_nos)
 
-        with open(hfname, "w") as f:
-            f.write("\n".join(header))
-
-        if cpp_lines:
-            with open(fname, "w") as f:
-                f.write("\n".join(cpp_lines))
-            if not added:
-                args.files.append(fname)
-    else:
-        if cpp_lines:
-            with open(hfname, "w") as f:
-                f.write("\n".join(h_lines))
-            with open(fname, "w") as f:
-                f.write("\n".join(cpp_lines))
-            if not added:
-                args.files.append(fname)
-        else:
-            with open(fname, "w") as f:
-                f.write("\n".join(h_lines))
 
 
+# transpiles or copies one source into tmp_dir, adding whatever needs
+# to be compiled because of it to args.files
+def process_arg(build, args, arg, use_headers=False):
+    if arg == '-':
+        from . import pipeline
+        lines = sys.stdin.readlines()
+        lines = pipeline.pipeline(lines, fname="<stdin>", add_source_map=args.add_source_map,
+            ctx=build.transpile.fork())
+        print_lines(lines)
+    else:
+        util.verbose("processing", arg)
+        if arg.endswith(".cpy") or arg.endswith(".okp"):
+            process_cpy_file(args, build, arg, use_headers)
+        if arg.endswith(".cpp") or arg.endswith(".c"):
+            process_cpp_file(args, build, arg)
+        if arg.endswith(".h"):
+            process_h_file(build, arg)
+        if arg.endswith(".o"):
+            args.files.append(arg)
+
+# with more than one job, the .cpy files of a project are transpiled up
+# front in a process pool and process_cpy_file picks up their results
+# from build.transpiled. the workers get the build's TranspileContext
+# with each file, and a copy of config for the cache settings (with spawn
+# they don't inherit our globals). what a worker prints is sent back with
+# its result and printed here, so messages from different workers don't
+# run into each other
+def init_transpile_worker(settings):
+    for k, v in settings.items():
+        setattr(config, k, v)
+    util.apply_split_cache_size()
+
+def transpile_worker(arg, ctx):
+    line_maps = {}
+    with util.collect_messages() as messages:
+        h_lines, cpp_lines = process_file(arg, line_maps, ctx)
+    return (h_lines, cpp_lines, line_maps), messages
+
+def transpile_files(build, files, jobs):
+    build.transpiled.clear()
+    cpys = [ f for f in files if f.endswith(".cpy") or f.endswith(".okp") ]
+    # the profiler's numbers would stay in the workers
+    if jobs < 2 or len(cpys) < 2 or profiler.enabled():
+        return
 
-def process_files(tmp_dir, args):
+    from concurrent.futures import ProcessPoolExecutor
+    util.verbose("transpiling", len(cpys), "files with", min(jobs, len(cpys)), "processes")
+    settings = dict((k, v) for k, v in vars(config).items() if k.isupper())
+    with ProcessPoolExecutor(max_workers=min(jobs, len(cpys)),
+        initializer=init_transpile_worker, initargs=(settings,)) as pool:
+        results = pool.map(transpile_worker, cpys, [ build.transpile ] * len(cpys))
+        for arg, (result, messages) in zip(cpys, results):
+            for message in messages:
+                util.debug(message)
+            build.transpiled[arg] = result
+
+def process_files(build, args):
     args.files = analysis.gather_files(args.files)
     files = list(args.files)
     # if we have multiple files, we have to generate their headers
     use_headers = len(files) > 1
     args.files = []
 
+    if not args.print_:
+        transpile_files(build, files, args.jobs or os.cpu_count() or 1)
+
     for arg in files:
-        if arg == '-':
-            lines = sys.stdin.readlines()
-            lines = pipeline.pipeline(lines, fname="<stdin>", add_source_map=args.add_source_map)
-            print_lines(lines)
-        else:
-            util.verbose("processing", arg)
-            if arg.endswith(".cpy") or arg.endswith(".okp"):
-                process_cpy_file(args, tmp_dir, arg, use_headers)
-            if arg.endswith(".cpp") or arg.endswith(".c"):
-                process_cpp_file(args, tmp_dir, arg)
-            if arg.endswith(".h"):
-                process_h_file(tmp_dir, arg)
-            if arg.endswith(".o"):
-                args.files.append(arg)
-
-def compile_files(tmp_dir, args):
-    cur_dir = os.getcwd()
+        process_arg(build, args, arg, use_headers)
+
+    for name, info in sorted(util.split_cache_info().items()):
+        util.verbose("%s cache:" % name, "%(hits)s hits, %(misses)s misses, %(size)s entries" % info)
+
+def output_name(args):
     outname = args.exename or "./a.out"
     if outname[0] != '/':
-        outname = os.path.join(cur_dir, outname)
+        outname = os.path.join(os.getcwd(), outname)
+    return outname
+
+def link_objects(build, ofiles, outname):
+    ofiles = [ os.path.normpath(f) for f in ofiles ]
+    ofiles = list(set(ofiles))
+    os.chdir(build.tmp_dir)
+    util.verbose("generating", outname)
+    cmd_args = ofiles + [ "-o", outname ] + build.compile_flags
+    run_cmd(build.cxx, cmd_args)
+
+def run_exe(outname):
+    if config.RUN_WITH_INPUT:
+        output = run_cmd(outname, stdin=sys.stdin.read())
+    else:
+        output = run_cmd(outname)
+    util.debug('OUTPUT:\n')
+    util.debug(output.decode("utf-8"))
+
+def compile_files(build, args):
+    tmp_dir = build.tmp_dir
+    outname = output_name(args)
 
     files = args.files
 
@@ -382,44 +609,85 @@ def compile_files(tmp_dir, args):
 
 
     if args.single_header:
+        from . import single_header
         os.chdir(tmp_dir)
-        single_header.compile(files, outname)
+        try:
+            single_header.compile(files, outname)
+        except single_header.IncludeCycle as e:
+            util.debug(e)
+            sys.exit(1)
 
     if not args.single_header and not args.print_ and more_than_stdin and not args.noexe:
-        ofiles = []
         files = list(set([ os.path.normpath(f) for f in files ]))
-        for arg in files:
-            if arg != '-':
-                if arg.endswith(".cpy") or arg.endswith(".okp"):
-                    ofiles.append(compile_cpy_file(tmp_dir, arg))
-                if arg.endswith(".o"):
-                    ofiles.append(arg)
-                if arg.endswith(".cpp"):
-                    ofiles.append(compile_cpp_file(tmp_dir, arg))
-                if arg.endswith(".c"):
-                    ofiles.append(compile_c_file(tmp_dir, arg))
-
-        ofiles = [ os.path.normpath(f) for f in ofiles ]
-        ofiles = list(set(ofiles))
-        os.chdir(tmp_dir)
-        util.verbose("generating", outname)
-        cmd_args = ofiles + [ "-o", outname ] + COMPILE_FLAGS
-        run_cmd(CXX, cmd_args)
+        prepare_pch(build, files)
+        if config.UNITY:
+            files = unity_build(build, files, config.UNITY_UNITS)
+        jobs = args.jobs or os.cpu_count() or 1
+        try:
+            ofiles = compile_objects(build, files, jobs)
+        except BuildFailed:
+            print("aborting")
+            sys.exit(1)
+        if config.USE_CACHE:
+            cache.evict("objects")
+            cache.evict("pch")
+
+        link_objects(build, ofiles, outname)
 
     if config.RUN_EXE:
-        if config.RUN_WITH_INPUT:
-            output = run_cmd(outname, stdin=sys.stdin.read())
+        run_exe(outname)
+
+
+# with --pch, the .cpp files okp generated (as opposed to .cpp files
+# passed in) are compiled with build.pch_flags to use the precompiled header
+def prepare_pch(build, files):
+    build.pch_flags = []
+    build.pch_files = set()
+    if not config.USE_PCH:
+        return
+
+    abs_tmp = os.path.abspath(build.tmp_dir)
+    for f in files:
+        if f.endswith(".cpp") and os.path.abspath(f).startswith(abs_tmp + os.sep):
+            build.pch_files.add(os.path.normpath(f))
+
+    from . import pch
+    build.pch_flags = pch.prepare(build.tmp_dir, sorted(build.pch_files), build.cxx,
+        build.compile_flags)
+
+# with --unity, the .cpp files are compiled as `count` unity files
+# instead. returns the files to compile
+def unity_build(build, files, count):
+    tmp_dir = build.tmp_dir
+    cpps = []
+    rest = []
+    for f in files:
+        if f.endswith(".cpp"):
+            # same path that compile_cpp_file compiles
+            name, ext = os.path.splitext(f)
+            cpps.append(os.path.join(tmp_dir, "%s.cpp" % name))
         else:
-            output = run_cmd(outname)
-        util.debug('OUTPUT:\n')
-        util.debug(output.decode("utf-8"))
+            rest.append(f)
 
+    if len(cpps) < 2:
+        return files
 
-# we need a two pass compilation so we correctly build
-# all necessary header files before compiling
-COMPILE_FLAGS=""
-def compile_project(args):
-    global COMPILE_FLAGS
+    from . import unity
+    cpps, clashing = unity.split_static_clashes(cpps)
+    rest.extend(clashing)
+    if len(cpps) < 2:
+        return rest + cpps
+
+    units = unity.write_units(tmp_dir, cpps, count)
+    for unit, members in units:
+        if any(os.path.normpath(m) in build.pch_files for m in members):
+            build.pch_files.add(os.path.normpath(unit))
+
+    return rest + [ unit for unit, members in units ]
+
+# sets up the compile flags and build dir that every build needs and
+# returns the BuildContext for the build
+def prepare_build(args):
     flags = []
     files = []
     for file in args.files:
@@ -428,11 +696,10 @@ def compile_project(args):
         else:
             files.append(file)
 
-    COMPILE_FLAGS = flags
-    COMPILE_FLAGS.extend(config.COMPILER_FLAGS)
+    flags.extend(config.COMPILER_FLAGS)
 
-    if COMPILE_FLAGS:
-        util.debug("compile flags:", " ".join(COMPILE_FLAGS))
+    if flags:
+        util.debug("compile flags:", " ".join(flags))
 
     if args.dir:
         tmp_dir = os.path.abspath(args.dir)
@@ -441,21 +708,38 @@ def compile_project(args):
         except OSError:
             pass
     else:
+        import tempfile
         tmp_dir = tempfile.mkdtemp()
     util.verbose("working tmp dir is", tmp_dir)
 
-    config.JOIN_ENDING_PERIODS = args.join_periods
+    ctx = TranspileContext.from_config(join_ending_periods=args.join_periods)
+    return BuildContext(tmp_dir, CXX, flags, ctx)
+
+def cleanup_build(args, build):
+    tmp_dir = build.tmp_dir
+    if not config.KEEP_DIR and not args.dir:
+        import shutil
+        util.verbose("removing", tmp_dir)
+        shutil.rmtree(tmp_dir)
+    else:
+        util.debug("compiled into", tmp_dir)
+
+# we need a two pass compilation so we correctly build
+# all necessary header files before compiling
+def compile_project(args):
+    build = prepare_build(args)
 
     try:
-        process_files(tmp_dir, args)
+        process_files(build, args)
+        profiler.finish_project(config.PROFILE_JSON)
+        if config.USE_CACHE:
+            cache.evict("transpile")
 
-        linters.run(tmp_dir, args)
+        if config.LINT:
+            from . import linters
+            linters.run(build.tmp_dir, args)
 
         if not (args.print_) and not args.transpile:
-            ofiles = compile_files(tmp_dir, args)
+            ofiles = compile_files(build, args)
     finally:
-        if not config.KEEP_DIR and not args.dir:
-            util.verbose("removing", tmp_dir)
-            shutil.rmtree(tmp_dir)
-        else:
-            util.debug("compiled into", tmp_dir)
+        cleanup_build(args, build)
@@ -0,0 +1,116 @@
+from __future__ import print_function
+
+import asyncio
+import subprocess
+import sys
+import time
+
+from . import util
+
+# runs commands as asyncio subprocesses, so a build can run its compiles
+# side by side from one thread. stderr is passed through as each command
+# writes it and also kept, so every command comes back as a Result with
+# its exit code, how long it took and what it printed
+
+CHUNK_SIZE = 1 << 16
+
+class Result:
+    def __init__(self, args, returncode, duration, stdout=b"", stderr=b"", timed_out=False):
+        self.args = args
+        self.returncode = returncode
+        self.duration = duration
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+    def describe(self):
+        if self.timed_out:
+            return "timed out after %.2fs" % self.duration
+        return "exit code %s after %.2fs" % (self.returncode, self.duration)
+
+    def check(self):
+        if not self.ok:
+            raise subprocess.CalledProcessError(self.returncode, self.args, self.stdout, self.stderr)
+        return self
+
+def echo_stderr(data):
+    sys.stderr.write(data.decode("utf-8", "replace"))
+    sys.stderr.flush()
+
+# reads stream into chunks. with echo, complete lines are passed on as
+# they arrive so the output of concurrent commands doesn't mix mid line
+async def pump(stream, chunks, echo=None):
+    pending = b""
+    while True:
+        data = await stream.read(CHUNK_SIZE)
+        if not data:
+            break
+
+        chunks.append(data)
+        if echo:
+            pending += data
+            end = pending.rfind(b"\n") + 1
+            if end:
+                echo(pending[:end])
+                pending = pending[end:]
+
+    if echo and pending:
+        echo(pending + b"\n")
+
+async def feed(stream, data):
+    try:
+        stream.write(data)
+        await stream.drain()
+        stream.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+# without stdin, the command reads from ours
+async def run_async(args, timeout=None, stdin=None, echo=echo_stderr):
+    start = time.time()
+    try:
+        proc = await asyncio.create_subprocess_exec(*args,
+            stdin=subprocess.PIPE if stdin is not None else None,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        util.debug("couldn't run %s: %s" % (args[0], e))
+        return Result(args, 127, time.time() - start, stderr=str(e).encode("utf-8"))
+
+    stdout, stderr = [], []
+    tasks = [ pump(proc.stdout, stdout), pump(proc.stderr, stderr, echo), proc.wait() ]
+    if stdin is not None:
+        tasks.append(feed(proc.stdin, stdin))
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        proc.kill()
+        await proc.wait()
+
+    return Result(args, proc.returncode, time.time() - start,
+        b"".join(stdout), b"".join(stderr), timed_out)
+
+def run(args, timeout=None, stdin=None, echo=echo_stderr):
+    return asyncio.run(run_async(args, timeout, stdin, echo))
+
+# runs commands with up to `jobs` at once. the results come back in the
+# same order as the commands
+def run_many(commands, jobs=1, timeout=None, echo=echo_stderr):
+    async def run_all():
+        slots = asyncio.Semaphore(max(1, jobs))
+        async def run_one(args):
+            async with slots:
+                util.verbose(" ".join(args))
+                return await run_async(args, timeout, echo=echo)
+
+        return await asyncio.gather(*[ run_one(args) for args in commands ])
+
+    if not commands:
+        return []
+    return asyncio.run(run_all())
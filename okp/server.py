@@ -0,0 +1,255 @@
+from __future__ import print_function
+
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+
+# okp --server keeps one warm okp process listening on a unix socket.
+# okpc (the client) hands it argv, cwd, the environment and its own
+# stdin/stdout/stderr file descriptors. the server forks a child for each
+# request, so every build runs with fresh config globals and its own cwd,
+# while skipping interpreter startup, imports and cache warmup.
+#
+# okpc hands over its environment and terminal, so both sides only talk
+# to a peer running as the same user: the default socket lives in a 0700
+# directory, okpc checks who owns the socket and the server, and the
+# server drops connections from other users
+
+HELLO = b"okp\n"
+
+class UntrustedSocket(Exception):
+    pass
+
+def socket_path(path=None):
+    if path:
+        return path
+    if os.environ.get("OKP_SOCKET"):
+        return os.environ["OKP_SOCKET"]
+
+    run_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(run_dir, "okp-%s" % os.getuid(), "okp.sock")
+
+# creates the directory the default socket lives in. anyone else could
+# have made it first in a shared /tmp, so an existing one has to be ours
+# and closed to everyone else
+def make_private_dir(dirname):
+    try:
+        os.mkdir(dirname, 0o700)
+    except OSError:
+        pass
+
+    st = os.lstat(dirname)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise UntrustedSocket("%s isn't a private directory owned by you" % dirname)
+
+# the uid of the process at the other end of sock, or None where the
+# platform can't tell us
+def peer_uid(sock):
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    pid, uid, gid = struct.unpack("3i", creds)
+    return uid
+
+def check_peer(sock):
+    uid = peer_uid(sock)
+    if uid is not None and uid != os.getuid():
+        raise UntrustedSocket("the other end of the socket runs as uid %s" % uid)
+
+# project imports the compile machinery lazily, so it is loaded here
+# once instead of in every child
+def warm_up():
+    from . import project
+    from . import pipeline
+    from . import diagnostics, pch, runner, single_header, unity
+    pipeline.pipeline(["def main():", '  print "hello"', "  read x"], fname="<warmup>")
+
+def run_request(conn):
+    from . import main_impl
+    from . import project
+
+    stream = conn.makefile("rb")
+    request = json.loads(stream.readline().decode("utf-8"))
+
+    os.environ.clear()
+    os.environ.update(request["env"])
+    os.chdir(request["cwd"])
+    project.CXX = os.environ.get("CXX", "g++")
+    sys.argv = [ "okp" ] + request["argv"]
+
+    code = 0
+    try:
+        main_impl.main()
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        code = 1
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.sendall(json.dumps({ "exit": code }).encode("utf-8") + b"\n")
+
+def handle(conn):
+    msg, fds, _, _ = socket.recv_fds(conn, len(HELLO), 3)
+    if msg != HELLO or len(fds) != 3:
+        return
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+
+    run_request(conn)
+
+def serve(path=None):
+    if not path and not os.environ.get("OKP_SOCKET"):
+        try:
+            make_private_dir(os.path.dirname(socket_path()))
+        except UntrustedSocket as e:
+            print("okp server:", e, file=sys.stderr)
+            sys.exit(1)
+
+    path = socket_path(path)
+    if os.path.exists(path):
+        os.unlink(path)
+
+    warm_up()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    sock.listen(16)
+
+    # children report their exit code over the socket, so we let the
+    # kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    print("okp server listening on", path, file=sys.stderr)
+
+    try:
+        while True:
+            conn, _ = sock.accept()
+            try:
+                check_peer(conn)
+            except UntrustedSocket as e:
+                print("okp server: dropped a connection,", e, file=sys.stderr)
+                conn.close()
+                continue
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                sock.close()
+                # compiles need their exit codes back from waitpid
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    handle(conn)
+                finally:
+                    os._exit(0)
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+# sends argv to a running server and returns its exit code, or None if
+# there is no server to talk to. raises UntrustedSocket if the socket or
+# the server belong to another user
+def forward(argv, path=None):
+    path = socket_path(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise UntrustedSocket("%s isn't a socket owned by you" % path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        check_peer(sock)
+    except (IOError, OSError):
+        sock.close()
+        return None
+    except UntrustedSocket:
+        sock.close()
+        raise
+
+    request = {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+    }
+
+    try:
+        socket.send_fds(sock, [ HELLO ], [ 0, 1, 2 ])
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        reply = sock.makefile("rb").readline()
+    finally:
+        sock.close()
+
+    if not reply:
+        print("okp server closed the connection", file=sys.stderr)
+        return 1
+
+    return json.loads(reply.decode("utf-8"))["exit"]
+
+# takes --socket out of argv, it is for okpc rather than the build
+def split_socket_arg(argv):
+    path = None
+    rest = []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--socket":
+            path = next(args, None)
+            if path is None:
+                print("okpc: --socket needs a path", file=sys.stderr)
+                sys.exit(2)
+        elif arg.startswith("--socket="):
+            path = arg[len("--socket="):]
+        else:
+            rest.append(arg)
+
+    return path, rest
+
+# entry point for okpc: use the server when one is running, otherwise
+# run okp in this process. a socket named with --socket (or OKP_SOCKET)
+# has to be there, we only fall back for the default one
+def client_main():
+    path, argv = split_socket_arg(sys.argv[1:])
+    try:
+        code = forward(argv, path)
+    except UntrustedSocket as e:
+        print("okpc: not using the okp server,", e, file=sys.stderr)
+        sys.exit(1)
+
+    if code is None:
+        if path or os.environ.get("OKP_SOCKET"):
+            print("okpc: no okp server listening on", socket_path(path), file=sys.stderr)
+            sys.exit(1)
+
+        from .main_impl import main
+        sys.argv = [ sys.argv[0] ] + argv
+        main()
+        return
+
+    sys.exit(code)
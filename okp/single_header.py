@@ -1,74 +1,26 @@
 #!/usr/bin/env python3
 from __future__ import print_function
 import argparse
-import copy
 import os
+import re
+import shutil
 import sys
+import tempfile
 from collections import defaultdict
+from . import analysis
+from . import config
 from . import util
 
 DEBUG = os.getenv("DEBUG", True)
 DEBUG_GRAPH=False
 
-def gather_includes(file, includes, parent=None, base_dir=None):
-    file_path = os.path.normpath(os.path.join(base_dir or "", file))
-
-    valid_exts = [".h", ".cpy", ".cpp", ".c", ".hpp"]
-    valid_ext = False
-    for ext in valid_exts:
-        if file.endswith(ext):
-            valid_ext = True
-
-    if not valid_ext:
-        return
-
-    if file_path == parent:
-        return
-
-
-    if file_path in includes:
-        if parent:
-            includes[parent].add(file_path)
-        return
-
-    if parent:
-        includes[parent].add(file_path)
-
-    dirname = os.path.dirname(file)
-    fname = os.path.basename(file)
-
-    if base_dir == None:
-        base_dir = dirname
-    else:
-        base_dir = os.path.join(base_dir, dirname)
-
-    if not os.path.exists(file_path):
-        print("missing file:", file, file=sys.stderr)
-        return
-
-    file = os.path.join(base_dir, fname)
-
-    with open(file_path) as f:
-        lines = f.readlines()
-
-    for line in lines:
-        cline = line.strip()
-        if cline.startswith("#include"):
-            tokens = cline.split()
-            include = tokens[1]
-            if include[0] != '"':
-                continue
-            include = include.strip('"')
-
-            fname, ext = os.path.splitext(include)
-            gather_includes(include, includes, parent=file_path, base_dir=base_dir)
-
-    return includes
-
-
+# the include graph of files: each file maps to the set of source files it
+# includes (not counting itself)
 def gather_files(files):
+    edges = defaultdict(set)
+    seen = set()
+
     ret = defaultdict(set)
-    original_dir = os.getcwd()
     for file in files:
         if file == "-":
             ret[file] = []
@@ -77,9 +29,12 @@ def gather_files(files):
         if not os.path.exists(file):
             continue
         file_dir, file = os.path.split(file)
-        gather_includes(file, ret, parent=None, base_dir=file_dir)
+        analysis.walk_includes(file, None, file_dir, edges, seen=seen)
 
-    os.chdir(original_dir)
+    for node, neighbors in edges.items():
+        for neighbor in neighbors:
+            if neighbor != node and neighbor.endswith(analysis.SOURCE_EXTS):
+                ret[node].add(neighbor)
 
     full_graph = defaultdict(set)
     for node, neighbors in ret.items():
@@ -105,43 +60,104 @@ def get_parser():
     return parser
 
 
-def n2_top_sort(graph):
+class IncludeCycle(Exception):
+    def __init__(self, cycle):
+        Exception.__init__(self, "found cyclic dependency: %s" % " -> ".join(cycle))
+        self.cycle = cycle
+
+# orders files so that every file comes after the files it includes. files
+# are emitted in batches (the files whose includes are all emitted) and
+# each batch is sorted, so the order doesn't depend on how the graph was
+# built. runs in O(V + E) plus the sorting
+def top_sort(graph):
+    remaining = {}
+    included_by = defaultdict(list)
+    for f, deps in graph.items():
+        remaining[f] = len(deps)
+        for dep in deps:
+            included_by[dep].append(f)
+
     ret = []
-    while graph:
-        batch = set()
-        for f, deps in graph.items():
-            if not deps:
-                batch.add(f)
-        for f in graph.keys():
-            graph[f] -= batch
-
-        ret.extend(list(sorted(batch)))
+    batch = [ f for f, count in remaining.items() if count == 0 ]
+    while batch:
+        batch.sort()
+        ret.extend(batch)
+        next_batch = []
         for f in batch:
-            del graph[f]
-        if not batch and graph:
-            print("found cyclic dependency", graph, file=sys.stderr)
-            exit()
-    return list(ret)
+            for parent in included_by[f]:
+                remaining[parent] -= 1
+                if remaining[parent] == 0:
+                    next_batch.append(parent)
+        batch = next_batch
+
+    if len(ret) < len(remaining):
+        raise IncludeCycle(find_cycle(graph, set(ret)))
+
+    return ret
+
+# every file that top_sort couldn't emit includes another such file, so
+# following those includes from any of them has to loop
+def find_cycle(graph, emitted):
+    f = min(f for f in graph if f not in emitted)
+    path = []
+    index = {}
+    while f not in index:
+        index[f] = len(path)
+        path.append(f)
+        f = min(dep for dep in graph[f] if dep not in emitted)
+
+    return path[index[f]:] + [ f ]
+
+
+# the lines concat_files cares about: "quoted" includes (which are dropped),
+# <system> includes (which can be hoisted) and conditionals (so we know
+# which system includes are safe to hoist)
+DIRECTIVE_RE = re.compile(r'^(?:(?P<quoted>#include ")|(?P<system>#include <)|'
+    r'[ \t]*#[ \t]*(?P<cond>ifndef|ifdef|if|endif)\b)[^\n]*\n?', re.MULTILINE)
+GUARD_RE = re.compile(r'[ \t]*#[ \t]*ifndef[ \t]+(\w+)[^\n]*\n[ \t]*#[ \t]*define[ \t]+\1\b')
+
+WRITE_BUFFER = 1 << 16
+
+# writes text to outfile without its "quoted" includes, copying everything
+# between them in one piece. if system_includes is given, <system> includes
+# outside of any #if block (other than an include guard) are added to it
+# instead of being written
+def copy_source(text, outfile, system_includes=None):
+    pos = 0
+    depth = 0
+    for m in DIRECTIVE_RE.finditer(text):
+        cond = m.group("cond")
+        if cond == "endif":
+            depth = max(depth - 1, 0)
+        elif cond:
+            is_guard = depth == 0 and cond == "ifndef" and GUARD_RE.match(text, m.start())
+            if not is_guard:
+                depth += 1
+        elif m.group("system") and (system_includes is None or depth):
+            continue
+        else:
+            outfile.write(text[pos:m.start()])
+            pos = m.end()
+            if m.group("system"):
+                system_includes[m.group(0).rstrip()] = True
 
+    outfile.write(text[pos:])
 
-def concat_files(files, outfile, graph):
+def concat_files(files, outfile, graph, banners=True, system_includes=None):
     for file in files:
         if not os.path.exists(file):
             print("MISSING FILE!", file, file=sys.stderr)
             continue
 
+        if banners:
+            outfile.write("\n/* FILE: %s */\n" % file)
+            outfile.write("\n/* REQUIRES:")
+            for f in sorted(graph[file]):
+                outfile.write("\n%s" % f)
+            outfile.write(" */\n")
+
         with open(file, "r") as infile:
-            if DEBUG:
-                outfile.write("\n/* FILE: %s */\n" % file)
-                deps = graph[file]
-                outfile.write("\n/* REQUIRES:")
-                for f in deps:
-                    outfile.write("\n%s" % f)
-                outfile.write(" */\n")
-
-            for line in infile.readlines():
-                if not (line.startswith("#include \"")):
-                    outfile.write(line)
+            copy_source(infile.read(), outfile, system_includes)
         outfile.write("\n")
 
 
@@ -154,17 +170,28 @@ def print_graph(graph):
 
 def compile(files, into):
     graph = gather_files(files)
-    orig_graph = copy.deepcopy(graph)
 
     if DEBUG_GRAPH:
         print_graph(graph)
 
-    ordered = n2_top_sort(graph)
+    ordered = top_sort(graph)
     if not into.endswith(".h"):
         into = "%s.h" % (into)
     util.debug("generating single header", into)
-    with open(into, "w") as output:
-        concat_files(ordered, output, orig_graph)
+    banners = DEBUG and config.SINGLE_HEADER_BANNERS
+    with open(into, "w", buffering=WRITE_BUFFER) as output:
+        if not config.SINGLE_HEADER_DEDUPE:
+            concat_files(ordered, output, graph, banners)
+            return
+
+        # the hoisted includes go first, so the body waits in a temp file
+        system_includes = {}
+        with tempfile.TemporaryFile("w+", buffering=WRITE_BUFFER) as body:
+            concat_files(ordered, body, graph, banners, system_includes)
+            for include in system_includes:
+                output.write("%s\n" % include)
+            body.seek(0)
+            shutil.copyfileobj(body, output, WRITE_BUFFER)
 
 
 if __name__ == "__main__":
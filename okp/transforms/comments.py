@@ -1,21 +1,148 @@
 import re
 
-# from stack overflow somewhere
-def comment_remover(text):
-    def replacer(match):
-        s = match.group(0)
-        if s.startswith('/'):
-            return " " # note: a space and not an empty string
-        else:
-            return s
+# comments are replaced by a single space. lines are handled one at a
+# time and every input line gives exactly one output line, so line numbers
+# (and the source map) stay right after multi-line comments: the lines a
+# block comment covers are left blank and the code after its end stays on
+# the line it was on, indented like the line the comment started on
+SPECIAL_RE = re.compile(r'//|/\*|[\'"]')
+STRING_RES = {
+    '"': re.compile(r'"(?:\\.|[^\\"])*"'),
+    "'": re.compile(r"'(?:\\.|[^\\'])*'"),
+}
+# a string that runs to the end of the line and continues on the next
+CONTINUED_RES = {
+    '"': re.compile(r'"(?:\\.|[^\\"])*\\$'),
+    "'": re.compile(r"'(?:\\.|[^\\'])*\\$"),
+}
+STRING_TAIL_RES = {
+    '"': re.compile(r'(?:\\.|[^\\"])*"'),
+    "'": re.compile(r"(?:\\.|[^\\'])*'"),
+}
 
-    pattern = re.compile(
-        r'//.*?$|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"',
-        re.DOTALL | re.MULTILINE
-    )
-    return re.sub(pattern, replacer, text)
+# splits lines on newlines, whether or not each item ends with one
+def physical_lines(lines):
+    partial = []
+    for chunk in lines:
+        if not partial and chunk.find('\n') == len(chunk) - 1 != -1:
+            yield chunk[:-1]
+            continue
 
+        if '\n' not in chunk:
+            partial.append(chunk)
+            continue
 
-def skip_comments(lines):
-    return comment_remover(''.join(lines)).split('\n')
+        parts = chunk.split('\n')
+        if partial:
+            parts[0] = ''.join(partial) + parts[0]
+            partial = []
+        for part in parts[:-1]:
+            yield part
+        if parts[-1]:
+            partial.append(parts[-1])
+
+    yield ''.join(partial)
+
+def strip_comments(lines):
+    lines = physical_lines(lines)
+    pieces = []
+    quote = None
+    # while inside a block comment: the lines it has covered so far, and
+    # the raw text from its start, in case it is never closed
+    covered = 0
+    comment_start = None
+    # leading whitespace of the line the current output line started on
+    indent = ''
+
+    for line in lines:
+        # without // or /* a line can't have a comment, and unless it ends
+        # in a backslash its strings end on it too
+        if comment_start is None and quote is None and \
+            '//' not in line and '/*' not in line and not line.endswith('\\'):
+            yield line
+            continue
+
+        if comment_start is None and quote is None:
+            indent = line[:len(line) - len(line.lstrip())]
+
+        pos = 0
+        while True:
+            if comment_start is not None:
+                end = line.find("*/", pos)
+                if end == -1:
+                    comment_start.append(line)
+                    break
+                # the line the comment started on and the ones it covered
+                yield ''.join(pieces)
+                for _ in range(covered - 1):
+                    yield ''
+                pieces = [ indent ]
+                covered = 0
+                comment_start = None
+                pos = end + 2
+                while line[pos:pos + 1] in (' ', '\t'):
+                    pos += 1
+                continue
+
+            if quote is not None:
+                m = STRING_TAIL_RES[quote].match(line, pos)
+                if m is None:
+                    # still inside a string continued with a backslash
+                    pieces.append(line[pos:])
+                    break
+                pieces.append(line[pos:m.end()])
+                pos = m.end()
+                quote = None
+                continue
 
+            m = SPECIAL_RE.search(line, pos)
+            if m is None:
+                pieces.append(line[pos:])
+                break
+
+            start = m.start()
+            pieces.append(line[pos:start])
+            token = m.group(0)
+            if token == '//':
+                pieces.append(" ")
+                break
+
+            if token == '/*':
+                pieces.append(" ")
+                end = line.find("*/", start + 2)
+                if end == -1:
+                    comment_start = [ line[start + 1:] ]
+                    break
+                pos = end + 2
+                continue
+
+            m = STRING_RES[token].match(line, start)
+            if m is not None:
+                pieces.append(m.group(0))
+                pos = m.end()
+            elif CONTINUED_RES[token].match(line, start):
+                pieces.append(line[start:])
+                quote = token
+                break
+            else:
+                # a lone quote is just a character
+                pieces.append(token)
+                pos = start + 1
+
+        if comment_start is not None:
+            covered += 1
+        else:
+            yield ''.join(pieces)
+            pieces = []
+
+    if comment_start is not None:
+        # the comment never ends, so its /* was just text. the / stays and
+        # the rest is stripped again
+        pieces[-1] = "/"
+        rest = strip_comments([ '\n'.join(comment_start) ])
+        yield ''.join(pieces) + next(rest)
+        for line in rest:
+            yield line
+
+def skip_comments(lines):
+    return list(strip_comments(lines))
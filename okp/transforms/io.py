@@ -1,4 +1,5 @@
 from ..util import *
+from .. import lexer
 
 def io_readline(line, read_token):
     sline = line.strip()
@@ -7,9 +8,9 @@ def io_readline(line, read_token):
     if read_token.startswith('raw_input'):
         is_readline = True
     if is_readline:
-        args = smart_split(sline[len(read_token):], ' ,')
+        args = lexer.split(sline, ' ,', start=len(read_token))
     else:
-        args = smart_split(sline[len(read_token):], ' ,')
+        args = lexer.split(sline, ' ,', start=len(read_token))
 
     # if the line already has >> or << on it, we don't process it
     for arg in args:
@@ -66,7 +67,7 @@ def io_printline(line, indent):
 
     call = "cout"
     if print_token:
-        args = smart_split(sline[len(print_token):], ' ,')
+        args = lexer.split(sline, ' ,', start=len(print_token))
         line = "%s%s << %s" % (' ' * indent, call, " << ".join(args))
         if add_space:
             line = '%s << " "' % (line)
@@ -83,9 +84,9 @@ def io_printline(line, indent):
             else:
                 call = "std::cout"
             if tok == "print ":
-                args = smart_split(sline[len(tok):], ',')
+                args = lexer.split(sline, ',', start=len(tok))
             else:
-                args = smart_split(sline[len(tok):], ' ,')
+                args = lexer.split(sline, ' ,', start=len(tok))
             no_add = False
             for arg in args:
                 if arg == "<<":
@@ -106,42 +107,41 @@ def io_printline(line, indent):
 
     return line
 
-def replace_io_keywords(lines):
-    new_lines = []
-    tokens = [ '?', '??', 'cin', 'raw_input']
-    for line in lines:
-        if ignore_line(line, new_lines):
-            continue
-        indent = get_indent(line)
-        sline = line.strip()
-
-        read_token = None
-        toks = smart_split(line, '(): ')
-
-        for i, t in enumerate(toks):
-            for tok in tokens:
-                if i > 0 and (tok[0] == '?'):
-                    continue
-
-                if t == tok:
-                    read_token = tok
-                    rtoks = toks[i:]
-                    rline = " ".join(rtoks)
-                    pline = toks[:i]
-
-        if read_token:
-            if len(pline):
-                pline = " ".join(pline) + " "
-            else:
-                pline = ""
+READ_TOKENS = [ '?', '??', 'cin', 'raw_input']
+
+def replace_io_line(line):
+    if is_ignored(line):
+        return line
+    indent = get_indent(line)
+    sline = line.strip()
+
+    read_token = None
+    toks = lexer.split(line, '(): ')
 
-            rline = io_readline(rline, read_token)
-            line = "%s%s%s" % (' ' * indent, pline, rline)
+    for i, t in enumerate(toks):
+        for tok in READ_TOKENS:
+            if i > 0 and (tok[0] == '?'):
+                continue
+
+            if t == tok:
+                read_token = tok
+                rtoks = toks[i:]
+                rline = " ".join(rtoks)
+                pline = toks[:i]
 
+    if read_token:
+        if len(pline):
+            pline = " ".join(pline) + " "
         else:
-            line = io_printline(line, indent)
+            pline = ""
+
+        rline = io_readline(rline, read_token)
+        line = "%s%s%s" % (' ' * indent, pline, rline)
 
+    else:
+        line = io_printline(line, indent)
 
-        new_lines.append(line)
+    return line
 
-    return new_lines
+def replace_io_keywords(lines):
+    return [ replace_io_line(line) for line in lines ]
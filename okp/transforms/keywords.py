@@ -1,8 +1,8 @@
 from ..util import *
+from .. import lexer
 import os
 
-def replace_raw(lines, base_dir):
-    new_lines = []
+def iter_raw(lines, base_dir, ctx=None):
     for line in lines:
         cline = line.strip()
         if cline.startswith("#raw "):
@@ -10,80 +10,91 @@ def replace_raw(lines, base_dir):
 
             for arg in args:
                 fname = os.path.join(base_dir, arg)
-                with open(fname) as f:
-                    new_lines.extend(f.readlines())
+                if ctx is not None:
+                    raw_lines = ctx.read_lines(fname)
+                else:
+                    with open(fname) as f:
+                        raw_lines = f.readlines()
+                for raw_line in raw_lines:
+                    yield raw_line
         else:
-            new_lines.append(line)
+            yield line
 
+def replace_raw(lines, base_dir, ctx=None):
+    return list(iter_raw(lines, base_dir, ctx))
 
-    return new_lines
+# the *_line functions transform a single line without looking at its
+# neighbors, so the pipeline can run several of them in one pass
+
+def replace_blocks_line(line):
+    if is_ignored(line):
+        return line
+
+    indent = get_indent(line)
+    cline = line.strip()
+    if cline.startswith('block:'):
+        line = "%s/* %s */" % (' ' * indent, cline)
+
+    return line
 
 def replace_blocks(lines):
-    new_lines = []
-    for line in lines:
-        if ignore_line(line, new_lines):
-            continue
+    return [ replace_blocks_line(line) for line in lines ]
 
-        indent = get_indent(line)
-        cline = line.strip()
-        if cline.startswith('block:'):
-            line = "%s/* %s */" % (' ' * indent, cline)
+def replace_knowns_line(line):
+    if is_ignored(line):
+        return line
 
-        new_lines.append(line)
-    return new_lines
+    indent = get_indent(line)
+    cline = line.strip()
+    if cline.startswith('known '):
+        cline = cline[len('known '):]
+        line = "%s%s" % (' ' * indent, cline)
 
-def replace_knowns(lines):
-    new_lines = []
-    for line in lines:
-        if ignore_line(line, new_lines):
-            continue
+    return line
 
-        indent = get_indent(line)
-        cline = line.strip()
-        if cline.startswith('known '):
-            cline = cline[len('known '):]
-            line = "%s%s" % (' ' * indent, cline)
+def replace_knowns(lines):
+    return [ replace_knowns_line(line) for line in lines ]
 
-        new_lines.append(line)
-    return new_lines
+def replace_tabs_line(line):
+    return line.replace('\t', '    ')
 
 def replace_tabs(lines):
-    return [ line.replace('\t', '    ') for line in lines ]
+    return [ replace_tabs_line(line) for line in lines ]
+
+def replace_pass_line(line):
+    if is_ignored(line):
+        return line
+
+    if line.strip() == "pass":
+        line = line.replace("pass", "(void)0")
+
+    return line
 
 def replace_pass(lines):
-    new_lines = []
-    for line in lines:
-        if ignore_line(line, new_lines):
-            continue
+    return [ replace_pass_line(line) for line in lines ]
 
-        if line.strip() == "pass":
-            line = line.replace("pass", "(void)0")
+def replace_self_line(line):
+    if line.find("self.") != -1:
+        line = line.replace("self.", "this->")
+    if line.find("self") != -1:
+        line = line.replace("self", "this")
 
-        new_lines.append(line)
+    # REPLACE $foo with this->foo
+    # this is used for instance variables to make sure they
+    # are well annotated
+    if line.find("$") == -1:
+        return line
 
-    return new_lines
+    tokens = lexer.split(line, " ", keep_splitters=True)
+    for i, token in enumerate(tokens):
+        if token and token[0] == "$":
+            token = "this->" + token[1:]
+            tokens[i] = token
 
-def replace_self(lines):
-    new_lines = []
-    for line in lines:
-        if line.find("self.") != -1:
-            line = line.replace("self.", "this->")
-        if line.find("self") != -1:
-            line = line.replace("self", "this")
-
-        # REPLACE $foo with this->foo
-        # this is used for instance variables to make sure they
-        # are well annotated
-        tokens = smart_split(line, " ", keep_splitters=True)
-        for i, token in enumerate(tokens):
-            if token and token[0] == "$":
-                token = "this->" + token[1:]
-                tokens[i] = token
-
-        line = "".join(tokens)
-        new_lines.append(line)
+    return "".join(tokens)
 
-    return new_lines
+def replace_self(lines):
+    return [ replace_self_line(line) for line in lines ]
 
 def replace_loop(line, keyword='for', op='<', inc='++'):
 
@@ -114,44 +125,40 @@ def replace_loop(line, keyword='for', op='<', inc='++'):
 
     return line
 
-def replace_for_shorthand(lines):
-    new_lines = []
-    for line in lines:
-        if ignore_line(line, new_lines):
-            continue
-
-        if config.ENABLE_FOR:
-           line = replace_loop(line, keyword='for')
-
-        if config.ENABLE_ROF:
-            line = replace_loop(line, keyword='rof', op='>=', inc='--')
+def replace_for_shorthand_line(line, ctx):
+    if is_ignored(line):
+        return line
 
+    if ctx.enable_for:
+       line = replace_loop(line, keyword='for')
 
+    if ctx.enable_rof:
+        line = replace_loop(line, keyword='rof', op='>=', inc='--')
 
-        new_lines.append(line)
+    return line
 
-    return new_lines
+def replace_for_shorthand(lines, ctx):
+    return [ replace_for_shorthand_line(line, ctx) for line in lines ]
 
 # finds and replaces "def" in front of functions
-def replace_defs(lines):
-    new_lines = []
-    for line in lines:
-        if ignore_line(line, new_lines):
-            continue
-
-        cline = line.strip()
-        if cline.startswith("def "):
-            tokens = cline.split()
-            next_word = tokens[1]
-            if next_word.find("(") == -1 or cline.find("main(") != -1 or cline.find("__new__") != -1 or cline.find("__del__") != -1:
-                line = line.replace("def ", "")
-            else:
-                # is a function
-                line = line.replace("def ", "auto ")
+def replace_defs_line(line):
+    if is_ignored(line):
+        return line
+
+    cline = line.strip()
+    if cline.startswith("def "):
+        tokens = cline.split()
+        next_word = tokens[1]
+        if next_word.find("(") == -1 or cline.find("main(") != -1 or cline.find("__new__") != -1 or cline.find("__del__") != -1:
+            line = line.replace("def ", "")
+        else:
+            # is a function
+            line = line.replace("def ", "auto ")
 
-        new_lines.append(line)
+    return line
 
-    return new_lines
+def replace_defs(lines):
+    return [ replace_defs_line(line) for line in lines ]
 
 def replace_imports(lines):
     new_lines = []
@@ -1,94 +1,110 @@
 from ..util import *
-from .. import config
 
 
-def add_trailing_semicolons(lines):
-    new_lines = []
-    indents = []
-    for line in lines:
-        indents.append(get_indent(line))
-
-    indents.append(0)
+# decides whether line needs a semicolon, given the indent of the next
+# non blank line after it
+def add_trailing_semicolon(line, indent, next_indent):
     double_ignore = IGNORE_CHAR + IGNORE_CHAR
-
-    for i, line in enumerate(lines):
-        line = line.rstrip();
-        cline = line.strip()
-
-        # we dont ignore lines with preceding semicolons
-        if ignore_line(line, new_lines):
-            continue
-        if cline == double_ignore:
-            new_lines.append(line)
-            continue
-
-        if not cline or cline[0] == '#':
-            new_lines.append(line)
+    line = line.rstrip();
+    cline = line.strip()
+
+    # we dont ignore lines with preceding semicolons
+    if is_ignored(line):
+        return line
+    if cline == double_ignore:
+        return line
+
+    if not cline or cline[0] == '#':
+        return line
+
+    if indent < next_indent:
+        return line
+
+    add_semi = True
+    # there are a lot of reasons not to add a semicolon, like
+    # if the line doesn't end with a backslash, colon or start with class keyword
+    # or if the line has a template< decl on it
+    if cline[-1] == '\\':
+        add_semi = False
+    elif cline[-1] == ':':
+        add_semi = False
+    elif cline[-1] == ';':
+        add_semi = False
+    elif cline[-1] == '{':
+        add_semi = False
+    elif cline.startswith('class '):
+        add_semi = False
+    elif line_is_template(cline):
+        add_semi = False
+
+    if add_semi:
+        # we have `do` here, just in case
+        for tok in ['for ', 'while ', 'do ', 'else if', 'if ']:
+            if cline.startswith(tok):
+                add_semi = False
+                break
+
+    if add_semi:
+        line += ';'
+
+    return line
+
+# a line's semicolon depends on the indent of the next non blank line, so
+# we hold on to the line (and any blank lines after it) until we see one
+def iter_trailing_semicolons(lines):
+    pending = None
+    blanks = []
+    for line in lines:
+        if not line.strip():
+            if pending is None:
+                yield line.rstrip()
+            else:
+                blanks.append(line.rstrip())
             continue
 
-        j = i+1
-        while j < len(lines) and not lines[j].strip():
-            j += 1
+        indent = get_indent(line)
+        if pending is not None:
+            yield add_trailing_semicolon(pending[0], pending[1], indent)
+            for blank in blanks:
+                yield blank
+            blanks = []
 
-        if indents[i] < indents[j]:
-            new_lines.append(line)
-            continue
+        pending = (line, indent)
 
-        add_semi = True
-        # there are a lot of reasons not to add a semicolon, like
-        # if the line doesn't end with a backslash, colon or start with class keyword
-        # or if the line has a template< decl on it
-        if cline[-1] == '\\':
-            add_semi = False
-        elif cline[-1] == ':':
-            add_semi = False
-        elif cline[-1] == ';':
-            add_semi = False
-        elif cline[-1] == '{':
-            add_semi = False
-        elif cline.startswith('class '):
-            add_semi = False
-        elif line_is_template(cline):
-            add_semi = False
-
-        if add_semi:
-            # we have `do` here, just in case
-            for tok in ['for ', 'while ', 'do ', 'else if', 'if ']:
-                if cline.startswith(tok):
-                    add_semi = False
-                    break
-
-        if add_semi:
-            line += ';'
-
-        new_lines.append(line)
+    if pending is not None:
+        yield add_trailing_semicolon(pending[0], pending[1], 0)
+        for blank in blanks:
+            yield blank
 
-    return new_lines
+def add_trailing_semicolons(lines):
+    return list(iter_trailing_semicolons(lines))
 
-def add_curly_braces(lines):
-    new_lines = []
+# braces get attached to the last non blank line, so the window holds that
+# line and every line after it until the next non blank line shows up
+def iter_curly_braces(lines):
     indent_levels = [0]
-    nb = 0
+    window = []
 
     outer_indent = 0
 
-    for i, line in enumerate(lines):
+    for line in lines:
         line = line.rstrip('\n')
         indent = get_indent(line)
         if not line.strip():
-            new_lines.append(line)
+            window.append(line)
             continue
 
-        if ignore_line(line, new_lines):
+        if is_ignored(line):
+            window.append(line)
             continue
 
         if visibility_line(line):
             # TODO: when we hit a public line, i guess we reset indent levels?
-            new_lines.append(line)
+            window.append(line)
             continue
 
         if hash_line(line):
-            new_lines.append(line)
+            window.append(line)
             continue
 
         if is_class(line):
@@ -97,43 +113,48 @@ def add_curly_braces(lines):
         if indent_levels[-1] > indent:
             while indent_levels[-1] > indent:
                 indent_levels.pop()
-                new_lines[nb] += ' }'
+                window[0] += ' }'
 
-                if indent_levels[-1] == outer_indent and new_lines[nb][-1] != ';':
-                    new_lines[nb] += ';'
+                if indent_levels[-1] == outer_indent and window[0][-1] != ';':
+                    window[0] += ';'
 
 
         if indent_levels[-1] < indent:
-            if nb < len(new_lines) and not visibility_line(new_lines[nb]):
+            if window and not visibility_line(window[0]):
                 indent_levels.append(indent)
-                if not case_statement(new_lines[nb]):
-                    new_lines[nb] = new_lines[nb].rstrip(':')
-                new_lines[nb] += ' {'
+                if not case_statement(window[0]):
+                    window[0] = window[0].rstrip(':')
+                window[0] += ' {'
 
-        new_lines.append(line)
+        for w in window:
+            yield w
 
         # last non blank line is this one
-        nb = i
+        window = [ line ]
 
-    while indent_levels:
+    while indent_levels and window:
         if indent_levels[-1] > 0:
-            new_lines[nb] += ' }'
+            window[0] += ' }'
 
-        if len(new_lines[nb]) and new_lines[nb][0] != "#" and new_lines[nb][-1] != ";":
-            new_lines[nb] += ';';
+        if len(window[0]) and window[0][0] != "#" and window[0][-1] != ";":
+            window[0] += ';';
 
         indent_levels.pop()
 
-    return new_lines
+    for w in window:
+        yield w
 
-def join_backslash_lines(tlines):
+def add_curly_braces(lines):
+    return list(iter_curly_braces(lines))
+
+def join_backslash_lines(tlines, ctx):
     new_lines = []
 
     i = 0
     full_line = []
     line_no = None
 
-    join_periods = config.JOIN_ENDING_PERIODS
+    join_periods = ctx.join_ending_periods
     while i < len(tlines):
         if not line_no:
             line_no = tlines[i][0]
@@ -267,37 +288,35 @@ def fix_dangling_hash_lines(tlines):
     new_lines.append(tlines[-1])
     return new_lines
 
-def add_preceding_ignore_chars(lines):
-    new_lines = []
+def iter_preceding_ignore_chars(lines):
     in_ignore_block = False
     ig = IGNORE_CHAR
     for line in lines:
         if line.strip().startswith('```'):
             in_ignore_block = not in_ignore_block
-            new_lines.append('')
+            yield ''
         elif in_ignore_block:
-            new_lines.append('%s%s%s' % (ig, ig, line))
+            yield '%s%s%s' % (ig, ig, line)
         else:
-            new_lines.append(line)
+            yield line
 
-    return new_lines
+def add_preceding_ignore_chars(lines):
+    return list(iter_preceding_ignore_chars(lines))
 
-def remove_preceding_ignore_chars(lines):
-    new_lines = []
+def remove_preceding_ignore_chars_line(line):
     double_ignore = IGNORE_CHAR + IGNORE_CHAR
-    for line in lines:
-        indent = get_indent(line)
-        sline = line.strip()
+    sline = line.strip()
 
-        if sline.find(double_ignore) != -1:
-            line = line.replace(double_ignore, '', 1)
+    if sline.find(double_ignore) != -1:
+        line = line.replace(double_ignore, '', 1)
 
-        if sline and sline[0] == IGNORE_CHAR:
-            line = line.replace(IGNORE_CHAR, ' ', 1)
+    if sline and sline[0] == IGNORE_CHAR:
+        line = line.replace(IGNORE_CHAR, ' ', 1)
 
-        new_lines.append(line)
+    return line
 
-    return new_lines
+def remove_preceding_ignore_chars(lines):
+    return [ remove_preceding_ignore_chars_line(line) for line in lines ]
 
 
 # we might have a case like: if (a) || (b): which still needs parentheses
@@ -318,23 +337,23 @@ def needs_parens(nline):
         return True
 
 
-def add_parentheses(lines):
-    new_lines = []
-    replace = ["if ", "while ", "for ", "else if ", "switch " ]
-    for line in lines:
-        if ignore_line(line, new_lines):
-            continue
+PAREN_KEYWORDS = ["if ", "while ", "for ", "else if ", "switch " ]
 
-        indent = get_indent(line)
-        sline = line.strip()
-        # TODO: join multiple lines (maybe look for next colon?)
-        for tok in replace:
-            if sline.startswith(tok):
-                nline = line[indent+len(tok):].rstrip(':')
-                if nline[-1] != ';' and needs_parens(nline):
-                    line = "%s%s(%s) " % (' ' * indent, tok, nline)
+def add_parentheses_line(line):
+    if is_ignored(line):
+        return line
 
-        new_lines.append(line)
+    indent = get_indent(line)
+    sline = line.strip()
+    # TODO: join multiple lines (maybe look for next colon?)
+    for tok in PAREN_KEYWORDS:
+        if sline.startswith(tok):
+            nline = line[indent+len(tok):].rstrip(':')
+            if nline[-1] != ';' and needs_parens(nline):
+                line = "%s%s(%s) " % (' ' * indent, tok, nline)
 
-    return new_lines
+    return line
+
+def add_parentheses(lines):
+    return [ add_parentheses_line(line) for line in lines ]
 
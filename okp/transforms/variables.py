@@ -2,7 +2,11 @@ from __future__ import print_function
 
 from ..util import *
 from .. import analysis
+from .. import lexer
+from .. import profiler
+import os
 import sys
+import zlib
 
 def var_access(arg):
     return dot_access(arg) or array_access(arg) or ptr_access(arg)
@@ -15,10 +19,6 @@ def no_punctuation(arg):
 
     return ''.join(narg)
 
-DESTRUCTURE_INDEX = 0
-
-DECLARE_VARIABLES = True
-
 # this function splits equals, skipping over '==' and turning '= ' into ''
 # we also do not consider equals that are inside brackets to be meaningful
 def split_equals(line):
@@ -59,7 +59,7 @@ def split_equals(line):
     return tokens
 
 def get_class(line):
-    tokens = smart_split(line, ' ')
+    tokens = lexer.split(line, ' ')
     if tokens[0] == "class":
         return tokens[1].rstrip(':')
     if tokens[0] == "struct":
@@ -67,8 +67,8 @@ def get_class(line):
     return ""
 
 
-def handle_unscoped_variables(line, scope):
-    if not DECLARE_VARIABLES:
+def handle_unscoped_variables(line, scope, ctx):
+    if not ctx.declare_variables:
         return line
 
     indent = get_indent(line)
@@ -81,7 +81,7 @@ def handle_unscoped_variables(line, scope):
     if len(tokens) == 2:
         lhs, rhs = tokens
         rhs = rhs.strip()
-        args = smart_split(lhs, ',')
+        args = lexer.split(lhs, ',')
         if len(args) > 1:
             return
 
@@ -96,16 +96,21 @@ def handle_unscoped_variables(line, scope):
 
 def handle_return_tuples(line, scope):
     indent = get_indent(line)
-    args = smart_split(line[indent + len('return'):], ',')
+    args = lexer.split(line, ',', start=indent + len('return'))
     if len(args) > 1:
         args = ', '.join(args).strip()
         line = "%sreturn make_tuple(%s)" % (' ' * indent, args)
     return line
 
-def handle_destructuring_decls(line, scope):
-    global DESTRUCTURE_INDEX
+# the temporaries are numbered by ctx.destructure_index, which counts up
+# through the file, and carry a tag made from the file's name: two files
+# that destructure at file scope would otherwise both declare
+# structuredArgs_0 and clash as soon as one includes the other
+def destructure_tag(fname):
+    return "%08x_" % zlib.crc32(os.path.normpath(fname).encode("utf-8"))
 
-    di = DESTRUCTURE_INDEX
+def handle_destructuring_decls(line, scope, ctx):
+    di = ctx.destructure_index
     indent = get_indent(line)
 
     # we need to split on single equals but not double equals
@@ -116,7 +121,7 @@ def handle_destructuring_decls(line, scope):
     if len(tokens) == 2:
         lhs, rhs = tokens
         rhs = rhs.strip()
-        args = smart_split(lhs, ',')
+        args = lexer.split(lhs, ',')
         if len(args) > 1:
 
             if lhs.find('[') != -1:
@@ -133,7 +138,7 @@ def handle_destructuring_decls(line, scope):
                 args = ','.join(args).strip()
                 line = '%sstd::tie(%s) = %s' % (' ' * indent, args, rhs)
             else:
-                pname = "structuredArgs_%s" % (di)
+                pname = "structuredArgs_%s%s" % (ctx.destructure_tag, di)
                 line = '%sauto %s = %s;' % (' ' * indent, pname, rhs)
                 for j, arg in enumerate(args):
                     arg = arg.strip(',').strip()
@@ -147,10 +152,10 @@ def handle_destructuring_decls(line, scope):
 
                 di += 1
 
-    DESTRUCTURE_INDEX = di
+    ctx.destructure_index = di
     return line
 
-def handle_for_loop_auto(line, scope):
+def handle_for_loop_auto(line, scope, ctx):
     # special for loop declarations
     sline = line.strip()
     if sline.startswith('for ') or sline.startswith('for('):
@@ -158,7 +163,7 @@ def handle_for_loop_auto(line, scope):
         # swallow it when parenthesizing
         sline = sline.rstrip(':')
 
-        args = smart_split(sline, ';')
+        args = lexer.split(sline, ';')
         if sline.startswith('for('):
             args[0] = args[0][len('for'):]
         else:
@@ -167,11 +172,11 @@ def handle_for_loop_auto(line, scope):
         args[0] = strip_outer_parens(args[0])
 
         # if our args are glommed together because of for loop bracketing, we
-        # try to unroll it using smart_split on the only item in the array
+        # try to unroll it using lexer.split on the only item in the array
         if len(args) == 1:
-            args = smart_split(args[0], ';')
+            args = lexer.split(args[0], ';')
 
-        stmts = smart_split(args[0], ',')
+        stmts = lexer.split(args[0], ',')
 
         arg0 = []
         for j, s in enumerate(stmts):
@@ -188,7 +193,7 @@ def handle_for_loop_auto(line, scope):
 
             arg = lhs.strip()
 
-            add_auto = DECLARE_VARIABLES
+            add_auto = ctx.declare_variables
             if j != 0:
                 add_auto = False
             elif s.find(":") != -1:
@@ -224,7 +229,7 @@ def handle_function_decls(line, scope, in_class):
         if lp == -1:
             return line
 
-        params = smart_split(line[pr+1:lp], ",")
+        params = lexer.split(line, ",", start=pr+1, end=lp)
 
         before_p = line[:pr]
         after_p = line[lp+1:]
@@ -233,7 +238,7 @@ def handle_function_decls(line, scope, in_class):
         # if any param has spaces in it, then we think it is a function declaration
         # foo(int a) vs foo(10, 20, "abc")
         for p in params:
-            args = smart_split(p, " ")
+            args = lexer.split(p, " ")
             if len(args) == 1:
                 var = args[0]
             elif len(args) >= 2:
@@ -276,10 +281,10 @@ def handle_function_decls(line, scope, in_class):
 
     return line
 
-def add_auto_declarations(lines):
+def add_auto_declarations(lines, ctx):
     new_lines = []
     class_start = 0
-    scopings = analysis.read_scopings(lines)
+    scopings = profiler.call("read_scopings", analysis.read_scopings, lines)
 
     keywords = ["if", "do ", "while", "else", "class", "struct", "typedef", "try", "catch"]
     in_class = []
@@ -315,7 +320,7 @@ def add_auto_declarations(lines):
     
         #TODO: if line has special syntax (@func?), we fix its args and remove the @func
         if sline.startswith('for ') or sline.startswith('for('):
-            line = handle_for_loop_auto(line, scope)
+            line = handle_for_loop_auto(line, scope, ctx)
 
         if sline.endswith(":"):
             line = handle_function_decls(line, scope, in_class)
@@ -325,37 +330,39 @@ def add_auto_declarations(lines):
         if line.strip().startswith('return'):
             line = handle_return_tuples(line, scope)
         if line.find('=') != -1 and not sline.endswith(':'):
-            line = handle_destructuring_decls(line, scope)
-            line = handle_unscoped_variables(line, scope)
+            line = handle_destructuring_decls(line, scope, ctx)
+            line = handle_unscoped_variables(line, scope, ctx)
 
         new_lines.append(line)
     return new_lines
 
 
-def replace_walrus_operator(lines):
-    newlines = []
-    for line in lines:
-        sline = line.strip()
-        if sline.startswith("for ") or sline.startswith("for("):
-            newlines.append(line)
-            continue
+def replace_walrus_line(line):
+    sline = line.strip()
+    if sline.startswith("for ") or sline.startswith("for("):
+        return line
 
-        tokens = smart_split(line, " ")
-        indent = get_indent(line)
-        walrus_toks = [t for t in tokens if ":=" in t and not t.startswith('"')]
-        if walrus_toks:
-            # for destructuring tuples, we let replace_destructuring_decls() handle
-            # the auto declaration
-            if "," in line and line.index(",") < line.index(":="):
-                newlines.append(line.replace(":=","="))
-            else:
-                new_toks = [indent*" "+"auto"]
-                for tok in tokens:
-                    if ":=" in tok and (not tok.startswith('"')):
-                        new_toks.append(tok.replace(":=","="))
-                    else:
-                        new_toks.append(tok)
-                newlines.append(" ".join(new_toks))
+    if line.find(":=") == -1:
+        return line
+
+    tokens = lexer.split(line, " ")
+    indent = get_indent(line)
+    walrus_toks = [t for t in tokens if ":=" in t and not t.startswith('"')]
+    if walrus_toks:
+        # for destructuring tuples, we let replace_destructuring_decls() handle
+        # the auto declaration
+        if "," in line and line.index(",") < line.index(":="):
+            return line.replace(":=","=")
         else:
-            newlines.append(line)
-    return newlines
+            new_toks = [indent*" "+"auto"]
+            for tok in tokens:
+                if ":=" in tok and (not tok.startswith('"')):
+                    new_toks.append(tok.replace(":=","="))
+                else:
+                    new_toks.append(tok)
+            return " ".join(new_toks)
+
+    return line
+
+def replace_walrus_operator(lines):
+    return [ replace_walrus_line(line) for line in lines ]
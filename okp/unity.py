@@ -0,0 +1,90 @@
+from __future__ import print_function
+
+import os
+import re
+from collections import defaultdict
+
+from . import analysis
+from . import single_header
+from . import util
+
+# okp --unity compiles the .cpp files of a build as a few larger
+# translation units. each unity file #includes its members instead of
+# copying them, so their #line directives and relative includes keep
+# working and diagnostics still point at the .cpy sources.
+#
+# file scope statics with the same name in two files would clash in one
+# unit, so files like that are left out of the units and compiled on
+# their own. other clashes (anonymous namespaces, file local macros or
+# typedefs) aren't detected
+
+UNITY_NAME = "okp_unity_%s.cpp"
+
+# the name a file scope static declares, as in `static int foo(...)` or
+# `static vector<int> cache;`
+STATIC_RE = re.compile(r'^static\s+[\w:<>,\s\*&]*?\b(\w+)\s*[(=;\[{]', re.MULTILINE)
+
+def static_names(cpp):
+    with open(cpp) as f:
+        return set(STATIC_RE.findall(f.read()))
+
+# splits cpps into the files that can share units and the ones whose
+# statics clash with another file's
+def split_static_clashes(cpps):
+    defined_in = defaultdict(set)
+    for cpp in cpps:
+        for name in static_names(cpp):
+            defined_in[name].add(cpp)
+
+    clashing = set()
+    for name, files in sorted(defined_in.items()):
+        if len(files) > 1:
+            util.verbose("unity build: static", name, "is defined in", " ".join(sorted(files)))
+            clashing.update(files)
+
+    return [ f for f in cpps if f not in clashing ], [ f for f in cpps if f in clashing ]
+
+# orders cpps so that a file comes after the files that implement the
+# headers it includes (b.cpp before a.cpp when a.cpp includes b.h). if
+# that has a cycle, the files are simply sorted
+def include_order(cpps):
+    implements = {}
+    for cpp in cpps:
+        implements[os.path.splitext(cpp)[0] + ".h"] = cpp
+
+    graph = {}
+    for cpp in cpps:
+        edges = defaultdict(set)
+        analysis.walk_includes(os.path.basename(cpp), None, os.path.dirname(cpp), edges)
+        deps = set()
+        for includes in edges.values():
+            for include in includes:
+                dep = implements.get(include)
+                if dep and dep != cpp:
+                    deps.add(dep)
+        graph[cpp] = deps
+
+    try:
+        return single_header.top_sort(graph)
+    except single_header.IncludeCycle as e:
+        util.verbose("unity build:", e)
+        return sorted(cpps)
+
+# splits cpps into `count` unity files of about the same size and returns
+# their paths
+def write_units(tmp_dir, cpps, count=1):
+    ordered = include_order([ os.path.normpath(os.path.abspath(f)) for f in cpps ])
+    count = max(1, min(count, len(ordered)))
+
+    units = []
+    for i in range(count):
+        members = ordered[i * len(ordered) // count:(i + 1) * len(ordered) // count]
+        unit = os.path.join(tmp_dir, UNITY_NAME % i)
+        with open(unit, "w") as f:
+            for member in members:
+                f.write('#include "%s"\n' % member)
+
+        util.verbose("unity file", unit, "includes", " ".join(members))
+        units.append((unit, members))
+
+    return units
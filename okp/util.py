@@ -2,8 +2,11 @@ from __future__ import print_function
 
 import re
 import sys
+import threading
+from contextlib import contextmanager
 
 from . import config
+from . import lexer
 
 IGNORE_CHAR = '`'
 
@@ -14,7 +17,26 @@ def verbose(*args):
         debug(*args)
 
 def debug(*args):
-    print(' '.join(map(str, args)), file=sys.stderr)
+    message = ' '.join(map(str, args))
+    messages = getattr(COLLECTED, "messages", None)
+    if messages is not None:
+        messages.append(message)
+    else:
+        print(message, file=sys.stderr)
+
+# while a thread is inside collect_messages, what it passes to debug() is
+# added to the yielded list instead of being printed
+COLLECTED = threading.local()
+
+@contextmanager
+def collect_messages():
+    messages = []
+    outer = getattr(COLLECTED, "messages", None)
+    COLLECTED.messages = messages
+    try:
+        yield messages
+    finally:
+        COLLECTED.messages = outer
 
 def find_matching(line, open, close, start):
     j = start
@@ -33,50 +55,44 @@ def find_matching(line, open, close, start):
     return line[start-1], start
 
 # we split with split chars
-# anything inside [], (), {} and <> are kept together
-# anything inside "" or '' is kept together
+# anything inside "", () and <> are kept together
 # we pass a separator, like ' ' or ',' and we get back the inner pieces
+# the splitting itself is done by lexer.split, which tokenizes each line
+# only once no matter how many separator sets it is split with
+#
+# the pieces come back as a tuple shared with the split cache, callers
+# that want to modify them need to make their own list
 
 def smart_split(line, split_chars, keep_splitters=False):
-    return [x for x in _smart_split(line, split_chars, keep_splitters)]
+    return _smart_split(line, split_chars, keep_splitters)
 
-from functools import lru_cache
-@lru_cache(maxsize=None)
-def _smart_split(line, split_chars, keep_splitters=False):
-    split = []
-    prev = []
+def split_uncached(line, split_chars, keep_splitters=False):
+    return tuple(lexer.split(line, split_chars, keep_splitters))
 
+# the split and tokenize caches are LRU caches holding up to `maxsize`
+# entries each (None means unbounded). long running processes can shrink
+# them and use split_cache_info() to see how well they are doing
+def set_split_cache_size(maxsize):
+    global _smart_split
+    _smart_split = lru_cache(maxsize=maxsize)(split_uncached)
+    lexer.set_cache_size(maxsize)
 
-    i = 0
-    while i < len(line):
-        c = line[i]
-        i += 1
+# the caches are created with config.SPLIT_CACHE_SIZE when util is first
+# imported, this resizes them if it was changed since
+def apply_split_cache_size():
+    if _smart_split.cache_info().maxsize != config.SPLIT_CACHE_SIZE:
+        set_split_cache_size(config.SPLIT_CACHE_SIZE)
 
-        if c in split_chars:
-            if prev:
-                split.append(''.join(prev))
-                prev = []
+def split_cache_info():
+    info = {}
+    for name, cached in [("smart_split", _smart_split), ("tokenize", lexer.tokenize)]:
+        hits, misses, maxsize, size = cached.cache_info()
+        info[name] = { "hits": hits, "misses": misses, "maxsize": maxsize, "size": size }
 
-            if keep_splitters:
-                split.append(c)
-
-        elif c == '"':
-            p, i = find_matching(line, '"', c, i)
-            prev.append(p)
-        elif c == '<':
-            p, i = find_matching(line, '<', '>', i)
-            prev.append(p)
-        elif c == '(':
-            p, i = find_matching(line, '(', ')', i)
-            prev.append(p)
-        else:
-            prev.append(c)
+    return info
 
-    if prev:
-        split.append(''.join(prev))
-
-    # debug("SPLIT", line, "INTO", split, "USING", split_chars)
-    return split
+from functools import lru_cache
+_smart_split = lru_cache(maxsize=config.SPLIT_CACHE_SIZE)(split_uncached)
 
 
 # splits a 'b c' d into [a, 'b c', d]
@@ -177,9 +193,12 @@ def strip_outer_parens(s):
 
     return s
 
-def ignore_line(s, nl):
+def is_ignored(s):
     sline = s.strip()
-    if sline and sline[0] == IGNORE_CHAR:
+    return bool(sline) and sline[0] == IGNORE_CHAR
+
+def ignore_line(s, nl):
+    if is_ignored(s):
         nl.append(s)
         return True
 
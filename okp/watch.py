@@ -0,0 +1,173 @@
+from __future__ import print_function
+
+import os
+import subprocess
+import time
+import traceback
+from collections import defaultdict
+
+from . import analysis
+from . import config
+from . import project
+from . import util
+
+# okp --watch builds the project once and then polls every file in its
+# include graph. when some of them change, only those files and the files
+# that include them (directly or not) are transpiled and compiled again
+# before the executable is relinked
+
+COMPILED_EXTS = (".cpy", ".okp", ".cpp", ".c", ".o")
+
+def include_graph(files):
+    graph = defaultdict(set)
+    sources = analysis.gather_files(files, graph)
+    return sources, graph
+
+def reverse_deps(graph, changed):
+    included_by = defaultdict(set)
+    for f, includes in graph.items():
+        for include in includes:
+            included_by[include].add(f)
+
+    affected = set(changed)
+    stack = list(changed)
+    while stack:
+        f = stack.pop()
+        for parent in included_by[f]:
+            if parent not in affected:
+                affected.add(parent)
+                stack.append(parent)
+
+    return affected
+
+def snapshot(paths):
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            mtimes[path] = None
+
+    return mtimes
+
+def watched_files(sources, graph):
+    files = set(os.path.normpath(s) for s in sources)
+    for f, includes in graph.items():
+        files.add(f)
+        files.update(includes)
+
+    return files
+
+class Build(object):
+    def __init__(self, context, args):
+        self.context = context
+        self.args = args
+        self.outname = project.output_name(args)
+        self.use_headers = False
+        # source -> files that get compiled because of it
+        self.outputs = {}
+        # file that gets compiled -> its .o file
+        self.objects = {}
+
+    def process(self, source):
+        self.args.files = []
+        project.process_arg(self.context, self.args, source, self.use_headers)
+        return [ f for f in self.args.files if f.endswith(COMPILED_EXTS) ]
+
+    # does what compile_project does after transpiling, in the mode the
+    # flags ask for. files is everything there is to compile and
+    # to_compile the part of it that changed
+    def finish(self, files, to_compile):
+        args = self.args
+        if args.print_ or args.transpile:
+            return
+
+        if args.single_header:
+            from . import single_header
+            os.chdir(self.context.tmp_dir)
+            try:
+                single_header.compile(files, self.outname)
+            except single_header.IncludeCycle as e:
+                util.debug(e)
+            return
+
+        project.prepare_pch(self.context, files)
+        jobs = args.jobs or os.cpu_count() or 1
+        if config.UNITY:
+            # a unity unit mixes changed and unchanged files, so every
+            # rebuild compiles all of them again
+            self.objects = {}
+            units = project.unity_build(self.context,
+                sorted(set(os.path.normpath(f) for f in files)), config.UNITY_UNITS)
+            ofiles = project.compile_objects(self.context, units, jobs)
+        else:
+            self.objects.update(zip(to_compile, project.compile_objects(self.context, to_compile, jobs)))
+            ofiles = list(self.objects.values())
+
+        if args.noexe:
+            util.debug("compiled", len(ofiles), "objects")
+            return
+
+        project.link_objects(self.context, ofiles, self.outname)
+        util.debug("built", self.outname)
+        if config.RUN_EXE:
+            project.run_exe(self.outname)
+
+    def rebuild(self, sources, dirty):
+        self.use_headers = len(sources) > 1
+        for source in list(self.outputs):
+            if source not in sources:
+                for f in self.outputs.pop(source):
+                    self.objects.pop(f, None)
+
+        cwd = os.getcwd()
+        try:
+            to_compile = []
+            for source in sources:
+                if source in dirty or source not in self.outputs:
+                    for f in self.outputs.get(source, []):
+                        self.objects.pop(f, None)
+                    self.outputs[source] = self.process(source)
+                    to_compile.extend(self.outputs[source])
+
+            self.finish([ f for source in sources for f in self.outputs[source] ], to_compile)
+        except project.BuildFailed:
+            util.debug("build failed, waiting for changes")
+        except subprocess.CalledProcessError as e:
+            util.debug("command failed:", e)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os.chdir(cwd)
+
+def watch_project(args):
+    if '-' in args.files:
+        util.debug("can't watch stdin")
+        return
+
+    context = project.prepare_build(args)
+    files = list(args.files)
+    build = Build(context, args)
+
+    try:
+        sources, graph = include_graph(files)
+        mtimes = snapshot(watched_files(sources, graph))
+        build.rebuild(sources, set(sources))
+
+        while True:
+            time.sleep(config.WATCH_INTERVAL)
+            current = snapshot(mtimes)
+            changed = set(f for f in current if current[f] != mtimes[f])
+            if not changed:
+                continue
+
+            util.debug("changed:", " ".join(sorted(changed)))
+            sources, graph = include_graph(files)
+            mtimes = snapshot(watched_files(sources, graph))
+            affected = reverse_deps(graph, changed)
+            dirty = set(s for s in sources if os.path.normpath(s) in affected)
+            build.rebuild(sources, dirty)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        project.cleanup_build(args, context)
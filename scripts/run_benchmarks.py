@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+# benchmarks for okp. measures pipeline throughput on generated .cpy
+# sources, include gathering on a wide include graph, the imports okp -p
+# pays for at startup and end to end builds of tests/projects.
+#
+#   python3 scripts/run_benchmarks.py -o results.json
+#   python3 scripts/run_benchmarks.py --compare results.json
+#
+# --compare exits with 1 if any benchmark got slower than the baseline by
+# more than --tolerance. the startup check also fails the run if okp -p
+# imports modules only compiles need, or with --import-budget, if its
+# imports take longer than the budget
+
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from okp import analysis
+from okp import config
+from okp import pipeline
+from okp import util
+from okp.version import __version__
+
+BENCHMARKS = []
+
+def benchmark(unit, better):
+    def register(func):
+        BENCHMARKS.append((func.__name__.replace("bench_", ""), func, unit, better))
+        return func
+    return register
+
+# sources {{{
+def nested_source(n):
+    lines = []
+    depth = 12
+    for f in range(n // (depth * 3) + 1):
+        lines.append("def func_%s(int a, int b):" % f)
+        for d in range(depth):
+            indent = "  " * (2 * d + 1)
+            lines.append("%sfor int i%s = 0; i%s < a; i%s++:" % (indent, d, d, d))
+            lines.append("%s  b += i%s * %s" % (indent, d, d))
+            lines.append("%s  if b > 100 and a < 10:" % indent)
+        lines.append("  " * (2 * depth + 1) + "return b")
+        lines.append("  return a + b")
+        lines.append("")
+
+    lines.extend([ "def main():", "  print func_0(1, 2)" ])
+    return lines
+
+def long_lines_source(n):
+    terms = [ 'f%s(a, "x, %s", (b + %s) * c, v[%s])' % (i, i, i, i) for i in range(20) ]
+    lines = [ "def main():", "  int a = 1, b = 2, c = 3" ]
+    for i in range(n):
+        lines.append("  x%s := %s" % (i, " + ".join(terms)))
+    return lines
+
+def classes_source(n):
+    lines = []
+    for c in range(n // 12 + 1):
+        lines.extend([
+            "class Shape%s:" % c,
+            "  public:",
+            "  int width, height",
+            "  vector<int> points",
+            "  def area():",
+            "    return self.width * self.height",
+            "  def scale(int k):",
+            "    self.width *= k",
+            "    self.height *= k",
+            "    self.points.push_back(k)",
+            "",
+            ""
+        ])
+
+    lines.extend([ "def main():", "  Shape0 s", "  print s.area()" ])
+    return lines
+
+def io_source(n):
+    lines = [ "def main():", "  int a, b", "  string s" ]
+    for i in range(n // 3):
+        lines.append("  cin a, b, s")
+        lines.append('  print "line %s:", a, b, s, a * b' % i)
+        lines.append('  print a + b, "and", (a - b)')
+    return lines
+
+SOURCES = [
+    ("nested", nested_source),
+    ("long_lines", long_lines_source),
+    ("classes", classes_source),
+    ("io", io_source),
+]
+# }}}
+
+# the time of each of `repeat` runs of func. run_benchmarks keeps the best
+def timed_runs(repeat, func):
+    samples = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        samples.append(time.time() - start)
+    return samples
+
+def clear_caches():
+    # the split caches would turn every run after the first into lookups
+    util.set_split_cache_size(config.SPLIT_CACHE_SIZE)
+
+def pipeline_benchmark(source):
+    def bench(opts):
+        lines = [ line + "\n" for line in source(opts.lines) ]
+        def run():
+            clear_caches()
+            pipeline.pipeline(list(lines), fname="<bench>")
+
+        samples = timed_runs(opts.repeat, run)
+        return [ len(lines) / s for s in samples ]
+    return bench
+
+for name, source in SOURCES:
+    func = pipeline_benchmark(source)
+    func.__name__ = "pipeline_%s" % name
+    benchmark("lines/s", "higher")(func)
+
+# main.cpy includes `width` headers which all include the same `width`
+# shared headers, so gathering has to skip files it already visited
+def write_include_graph(dirname, width):
+    for i in range(width):
+        with open(os.path.join(dirname, "shared%s.h" % i), "w") as f:
+            f.write("int shared%s();\n" % i)
+
+        with open(os.path.join(dirname, "mod%s.cpy" % i), "w") as f:
+            for j in range(width):
+                f.write('#include "shared%s.h"\n' % j)
+            f.write("def mod%s():\n  return %s\n" % (i, i))
+
+    with open(os.path.join(dirname, "main.cpy"), "w") as f:
+        for i in range(width):
+            f.write('#include "mod%s.cpy"\n' % i)
+        f.write("def main():\n  return 0\n")
+
+@benchmark("s", "lower")
+def bench_gather_files(opts):
+    tmp_dir = tempfile.mkdtemp(prefix="okp_bench")
+    try:
+        write_include_graph(tmp_dir, opts.width)
+        main = os.path.join(tmp_dir, "main.cpy")
+        return timed_runs(opts.repeat, lambda: analysis.gather_files([ main ]))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def project_benchmark(project):
+    def bench(opts):
+        # okp puts generated files at os.path.join(its tmp dir, source), which
+        # is the source's own directory when the path is absolute. we pass
+        # absolute paths to a copy of the project so tests/projects stays clean
+        tmp_dir = tempfile.mkdtemp(prefix="okp_bench")
+        project_dir = os.path.join(tmp_dir, os.path.basename(project))
+        shutil.copytree(project, project_dir)
+
+        files = []
+        for ext in ("cpy", "h", "cpp"):
+            files.extend(sorted(glob.glob(os.path.join(project_dir, "*.%s" % ext))))
+
+        cmd = [ sys.executable, "-m", "okp.main", "-for", "-rof", "--no-cache" ] + files + \
+            [ "-o", os.path.join(tmp_dir, "exe") ]
+
+        def run():
+            subprocess.check_output(cmd, cwd=ROOT, stderr=subprocess.STDOUT)
+
+        try:
+            return timed_runs(opts.repeat, run)
+        finally:
+            shutil.rmtree(tmp_dir)
+    return bench
+
+# okp -p only transpiles, so it shouldn't load anything that only
+# compiles (or linting) need
+LAZY_MODULES = [ "asyncio", "subprocess", "concurrent.futures", "future", "clang",
+    "okp.runner", "okp.pch", "okp.unity", "okp.single_header", "okp.diagnostics", "okp.linters",
+    "okp.api" ]
+
+# runs okp -p in a fresh interpreter and returns the ms it spent in
+# imports and the modules it imported
+def startup_imports():
+    tmp_dir = tempfile.mkdtemp(prefix="okp_bench")
+    try:
+        fname = os.path.join(tmp_dir, "main.cpy")
+        with open(fname, "w") as f:
+            f.write("\n".join(io_source(30)) + "\n")
+
+        cmd = [ sys.executable, "-X", "importtime", "-c", "import okp; okp.main()",
+            "-p", "--no-cache", fname ]
+        output = subprocess.run(cmd, cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, env=dict(os.environ, PYTHONPATH=ROOT)).stderr.decode("utf-8")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    total = 0
+    modules = set()
+    for line in output.splitlines():
+        m = re.match(r"import time:\s*\d+ \|\s*(\d+) \|( *)(\S+)", line)
+        if not m:
+            continue
+        modules.add(m.group(3))
+        # nested imports are already counted in their parent's time
+        if len(m.group(2)) == 1:
+            total += int(m.group(1))
+
+    return total / 1000.0, modules
+
+@benchmark("ms", "lower")
+def bench_startup_imports(opts):
+    return [ startup_imports()[0] for _ in range(opts.repeat) ]
+
+# returns what is wrong with okp -p's imports: modules it shouldn't load
+# and going over the budget (in ms, if there is one)
+def check_startup(budget=None):
+    problems = []
+    elapsed, modules = startup_imports()
+    for name in LAZY_MODULES:
+        if name in modules:
+            problems.append("okp -p imports %s" % name)
+    if budget and elapsed > budget:
+        problems.append("okp -p spends %.1fms importing, the budget is %.1fms" % (elapsed, budget))
+    return problems
+
+# projects that don't build (run_tests.sh skips them too). imports uses
+# `import b`, which okp doesn't support yet
+BROKEN_PROJECTS = [ "imports" ]
+
+for project in sorted(glob.glob(os.path.join(ROOT, "tests", "projects", "*"))):
+    if os.path.basename(project) in BROKEN_PROJECTS:
+        continue
+    func = project_benchmark(project)
+    func.__name__ = "compile_project_%s" % os.path.basename(project)
+    benchmark("s", "lower")(func)
+
+def run_benchmarks(opts):
+    results = {}
+    for name, func, unit, better in BENCHMARKS:
+        if opts.filter and not re.search(opts.filter, name):
+            continue
+
+        try:
+            samples = func(opts)
+        except subprocess.CalledProcessError as e:
+            print("%-40s failed with exit code %s" % (name, e.returncode), file=sys.stderr)
+            continue
+
+        value = max(samples) if better == "higher" else min(samples)
+        results[name] = { "value": value, "unit": unit, "better": better, "samples": samples }
+        print("%-40s %12.4f %s" % (name, value, unit))
+        sys.stdout.flush()
+
+    return results
+
+# returns the names of benchmarks that regressed past tolerance
+def compare(results, baseline, tolerance):
+    regressed = []
+    print("\n%-40s %12s %12s %8s" % ("benchmark", "baseline", "current", "change"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        base = baseline[name]["value"]
+        value = results[name]["value"]
+        if results[name]["better"] == "higher":
+            change = value / base - 1 if base else 0
+        else:
+            change = base / value - 1 if value else 0
+
+        status = ""
+        if change < -tolerance:
+            status = "REGRESSED"
+            regressed.append(name)
+
+        print("%-40s %12.4f %12.4f %+7.1f%% %s" % (name, base, value, 100 * change, status))
+
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark okp")
+    parser.add_argument("filter", nargs="?", help="only run benchmarks matching this regex")
+    parser.add_argument("-o", "--output", help="write results to this json file")
+    parser.add_argument("--compare", help="compare against results from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+        help="allowed slowdown before a benchmark counts as regressed (default 0.15)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark, best one is kept")
+    parser.add_argument("--lines", type=int, default=5000, help="lines per generated source")
+    parser.add_argument("--width", type=int, default=60, help="fan out of the include graph")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs and fewer runs")
+    parser.add_argument("--import-budget", type=float, default=None,
+        help="fail if okp -p spends more than this many ms importing modules")
+    opts = parser.parse_args()
+
+    if opts.quick:
+        opts.repeat = 1
+        opts.lines //= 10
+        opts.width //= 4
+
+    config.USE_CACHE = False
+    results = run_benchmarks(opts)
+
+    problems = []
+    if not opts.filter or re.search(opts.filter, "startup_imports"):
+        problems = check_startup(opts.import_budget)
+        for problem in problems:
+            print("startup check failed:", problem, file=sys.stderr)
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "options": { "repeat": opts.repeat, "lines": opts.lines, "width": opts.width },
+        "benchmarks": results,
+    }
+
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+
+        if baseline.get("options") != report["options"]:
+            print("warning: baseline was run with options", baseline.get("options"), file=sys.stderr)
+
+        if compare(results, baseline["benchmarks"], opts.tolerance):
+            sys.exit(1)
+
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -128,6 +128,23 @@ function run_project_test() {
   test_output ${exe_name} ${in_name} ${out_name} ${tmp_name} ${diff_name}
 }
 
+# runs a python script from tests/checks. a check fails by exiting with a
+# non zero code (an assert does), its output is only shown then
+function run_check() {
+  if ! [[ ${1} =~ ${tests_to_run} ]]; then
+    return
+  fi
+
+  output=$(PYTHONPATH=. python3 ${1} 2>&1)
+  if [[ $? != 0 ]]; then
+    echo "${output}"
+    echo "FAILED: ${1}"
+    FAILED=$(($FAILED+1))
+  else
+    echo "PASSED: ${1}"
+    PASSED=$(($PASSED+1))
+  fi
+}
 
 function basic_tests() {
   echo "running basic tests"
@@ -173,6 +190,7 @@ function project_tests() {
   echo "running project tests"
   run_project_test tests/projects/simple
   run_project_test tests/projects/hoisting
+  run_project_test tests/projects/destructuring
 }
 
 function external_tests() {
@@ -204,12 +222,28 @@ function failing_tests() {
   run_test_to_fail tests/failing/walrus_operator_mixed_types.cpy
 }
 
+function script_checks() {
+  echo "running script checks"
+  run_check tests/checks/lexer.py
+  run_check tests/checks/scopes.py
+  run_check tests/checks/cache.py
+  run_check tests/checks/top_sort.py
+  run_check tests/checks/diagnostics.py
+  run_check tests/checks/api.py
+  run_check tests/checks/parallel.py
+  run_check tests/checks/unity.py
+  run_check tests/checks/pch.py
+  run_check tests/checks/comments.py
+  run_check tests/checks/batch.py
+}
+
 
 basic_tests
 failing_tests
 project_tests
 external_tests
 misc_tests
+script_checks
 
 echo "TOTAL PASSED: ${PASSED}"
 echo "TOTAL FAILED: ${FAILED}"
@@ -14,12 +14,11 @@ setup(
     author_email='okayzed+okp@gmail.com',
     include_package_data=True,
     packages=['okp', 'okp.transforms', 'okp.linters'],
-    scripts=['scripts/okp'],
+    scripts=['scripts/okp', 'scripts/okpc'],
     url='http://github.com/okayzed/okp',
     license='MIT',
     description='an compiler for .cpy files',
     long_description=open('README.md').read(),
     long_description_content_type='text/markdown',
-    install_requires=[ "future" ],
     )
 
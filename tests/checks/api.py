@@ -0,0 +1,75 @@
+# checks for okp.api.transpile_project: it gives the files okp -t writes,
+# without reading or writing anything on disk itself
+
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import okp
+
+PROJECTS = [ "simple", "hoisting", "cpy_class", "cpy_red_black_tree", "cpy_selection_sort" ]
+
+def read_sources(project_dir):
+    files = {}
+    for path in glob.glob(os.path.join(project_dir, "*.cpy")):
+        with open(path) as f:
+            files[os.path.basename(path)] = f.read()
+    return files
+
+# what okp -t writes for the project, with #line directives off since
+# they name absolute paths
+def transpile_on_disk(project_dir):
+    tmp_dir = tempfile.mkdtemp(prefix="okp_check")
+    try:
+        shutil.copytree(project_dir, os.path.join(tmp_dir, "src"))
+        src = os.path.join(tmp_dir, "src")
+        sources = sorted(os.path.basename(p) for p in glob.glob(os.path.join(src, "*.cpy")))
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        subprocess.check_call([ sys.executable, "-c", "import okp; okp.main()", "-t", "-ns", "-nc",
+            "-d", "build" ] + sources, cwd=src, env=env, stdout=subprocess.DEVNULL)
+
+        generated = {}
+        for path in glob.glob(os.path.join(src, "build", "*")):
+            with open(path) as f:
+                generated[os.path.basename(path)] = f.read()
+        return generated
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def check_projects():
+    for project in PROJECTS:
+        project_dir = os.path.join("tests", "projects", project)
+        expected = transpile_on_disk(project_dir)
+        got = okp.transpile_project(read_sources(project_dir), add_source_map=False)
+        assert sorted(got) == sorted(expected), (project, sorted(got), sorted(expected))
+        for name, generated in got.items():
+            assert generated.text.rstrip("\n") == expected[name].rstrip("\n"), (project, name)
+
+def check_in_memory():
+    files = {
+        "lib/util.cpy": "int twice(int x):\n  return x * 2\n",
+        "main.cpy": '#include "lib/util.h"\n#raw "extra.h"\nint main():\n  print twice(2)\n',
+        "extra.h": "#define EXTRA 1\n",
+    }
+
+    cwd = os.getcwd()
+    before = sorted(os.listdir(cwd))
+    out = okp.transpile_project(files)
+    assert os.getcwd() == cwd and sorted(os.listdir(cwd)) == before
+
+    assert sorted(out) == [ "lib/util.h", "main.cpp" ], sorted(out)
+    assert out["main.cpp"].source == "main.cpy"
+    assert "#define EXTRA 1" in out["main.cpp"].text
+
+    # every line that came from a .cpy maps back to it, in order
+    for name, source, line_count in [ ("lib/util.h", "lib/util.cpy", 2), ("main.cpp", "main.cpy", 4) ]:
+        generated = out[name]
+        assert len(generated.line_map) == len(generated.text.split("\n")), name
+        mapped = [ location for location in generated.line_map if location is not None ]
+        assert mapped == [ (source, i) for i in range(1, line_count + 1) ], (name, mapped)
+
+check_projects()
+check_in_memory()
@@ -0,0 +1,88 @@
+# checks for okp --batch: one result per job in the order the jobs came
+# in, warnings and failures reported per job, #raw kept off the disk,
+# nothing left in the transpile cache and no hang when the reader goes
+# away
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+def batch(jobs_text, *flags, **kwargs):
+    return subprocess.run([ sys.executable, "-c", "import okp; okp.main()", "--batch" ] + list(flags),
+        input=jobs_text.encode("utf-8"), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        timeout=120, **kwargs)
+
+def jobs_text():
+    jobs = [ json.dumps({ "id": i, "source": "int main():\n  x := %s\n  print x\n" % i }) for i in range(12) ]
+    jobs.insert(3, "not json")
+    jobs.insert(5, json.dumps({ "id": "nosrc" }))
+    jobs.insert(7, json.dumps({ "id": "opts", "source": "x\n", "options": { "bogus": 1 } }))
+    jobs.append(json.dumps({ "id": "for", "source": "int main():\n  for i 0 3\n    print i\n",
+        "options": { "enable_for": True } }))
+    jobs.append(json.dumps({ "id": "warn", "source": "int main():\n  int x = (1}\n" }))
+    jobs.append(json.dumps({ "id": "raw", "source": '#raw "%s"\n' % os.path.abspath(__file__) }))
+    jobs.append(json.dumps({ "id": "rawfiles", "source": '#raw "a.h"\n',
+        "options": { "files": { "a.h": "int from_a;\n" } } }))
+    return "\n".join(jobs) + "\n"
+
+def check_results(cache_dir):
+    env = dict(os.environ, OKP_CACHE_DIR=cache_dir)
+    outputs = []
+    for flags in ([], [ "-j", "2" ]):
+        proc = batch(jobs_text(), *flags, env=env)
+        assert proc.returncode == 0, proc.stderr
+        results = [ json.loads(line) for line in proc.stdout.decode("utf-8").splitlines() ]
+        outputs.append(results)
+
+        ids = [ r["id"] for r in results ]
+        assert ids == [ 0, 1, 2, None, 3, "nosrc", 4, "opts" ] + list(range(5, 12)) + \
+            [ "for", "warn", "raw", "rawfiles" ], ids
+        failed = [ r["id"] for r in results if not r["ok"] ]
+        assert failed == [ None, "nosrc", "opts", "raw" ], failed
+        assert all(r["diagnostics"] for r in results if not r["ok"])
+        assert "auto x = 7;" in results[ids.index(7)]["output"]
+        assert "for (auto i = 0; i < 3; i++)" in results[ids.index("for")]["output"]
+
+        warn = results[ids.index("warn")]
+        assert warn["ok"] and "Mismatched bracket" in warn["diagnostics"][0], warn
+        assert results[ids.index(0)]["diagnostics"] == []
+        assert "int from_a;" in results[ids.index("rawfiles")]["output"]
+        assert "Mismatched" not in proc.stderr.decode("utf-8")
+
+    assert outputs[0] == outputs[1]
+    assert not os.path.exists(os.path.join(cache_dir, "transpile")), os.listdir(cache_dir)
+
+# the reader closes its end after the first result, okp should stop
+# without a traceback instead of blocking
+def check_closed_output():
+    text = jobs_text() * 50
+    for flags in ([], [ "-j", "2" ]):
+        proc = subprocess.Popen([ sys.executable, "-c", "import okp; okp.main()", "--batch", "-nc" ] + flags,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def feed():
+            try:
+                proc.stdin.write(text.encode("utf-8"))
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+
+        proc.stdout.readline()
+        proc.stdout.close()
+        proc.wait(timeout=120)
+        feeder.join()
+        stderr = proc.stderr.read().decode("utf-8")
+        assert "Traceback" not in stderr, stderr
+
+cache_dir = tempfile.mkdtemp(prefix="okp_check")
+try:
+    check_results(cache_dir)
+finally:
+    shutil.rmtree(cache_dir)
+check_closed_output()
@@ -0,0 +1,123 @@
+# checks for okp.cache: what goes into the keys and how eviction trims the
+# cache. everything is written under a temporary cache dir
+
+import os
+import shutil
+import tempfile
+
+from okp import cache
+from okp import config
+from okp import util
+from okp.context import TranspileContext
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+def check_object_keys(root):
+    a, b = os.path.join(root, "a"), os.path.join(root, "b")
+    for tmp_dir in (a, b):
+        os.makedirs(tmp_dir)
+        write(os.path.join(tmp_dir, "util.h"), "int f();\n")
+        write(os.path.join(tmp_dir, "main.cpp"), '#include "util.h"\n// %s/main.cpp\n' % tmp_dir)
+
+    key = cache.object_key(a, os.path.join(a, "main.cpp"), "g++", [ "-O2" ])
+    assert key is not None
+
+    # the same build in another tmp dir
+    assert cache.object_key(b, os.path.join(b, "main.cpp"), "g++", [ "-O2" ]) == key
+
+    assert cache.object_key(a, os.path.join(a, "main.cpp"), "clang++", [ "-O2" ]) != key
+    assert cache.object_key(a, os.path.join(a, "main.cpp"), "g++", [ "-O0" ]) != key
+
+    # a change in an included header
+    write(os.path.join(b, "util.h"), "int g();\n")
+    assert cache.object_key(b, os.path.join(b, "main.cpp"), "g++", [ "-O2" ]) != key
+
+    # an upgraded compiler keeps its name but not its mtime or size
+    cxx = os.path.join(root, "fake-g++")
+    write(cxx, "#!/bin/sh\n")
+    os.chmod(cxx, 0o755)
+    os.utime(cxx, (1000, 1000))
+    key = cache.object_key(a, os.path.join(a, "main.cpp"), cxx, [ "-O2" ])
+    os.utime(cxx, (2000, 2000))
+    assert cache.object_key(a, os.path.join(a, "main.cpp"), cxx, [ "-O2" ]) != key
+
+    # a header we can't find means we can't know what gets compiled
+    write(os.path.join(b, "main.cpp"), '#include "missing.h"\n')
+    assert cache.object_key(b, os.path.join(b, "main.cpp"), "g++", [ "-O2" ]) is None
+
+def check_objects(root):
+    ofname = os.path.join(root, "main.o")
+    write(ofname, "object")
+    out = os.path.join(root, "fetched.o")
+
+    assert not cache.fetch_object("ab12", out)
+    cache.store_object("ab12", ofname)
+    assert cache.fetch_object("ab12", out)
+    with open(out) as f:
+        assert f.read() == "object"
+
+def check_evict():
+    paths = []
+    for i in range(5):
+        key = "%02d%s" % (i, "e" * 10)
+        path = cache.entry_path("objects", key, ".o")
+        cache.store_entry(path, lambda tmp_path: write(tmp_path, "x" * 100))
+        os.utime(path, (1000 + i, 1000 + i))
+        paths.append(path)
+
+    # using an entry makes it recent again
+    assert cache.fetch_object("00" + "e" * 10, os.path.join(config.CACHE_DIR, "out.o"))
+
+    cache.evict("objects", 1000)
+    assert all(os.path.exists(path) for path in paths)
+
+    cache.evict("objects", 250)
+    assert [ os.path.exists(path) for path in paths ] == [ True, False, False, False, True ]
+
+    cache.evict("objects", 0)
+    assert not any(os.path.exists(path) for path in paths)
+
+def check_transpile_keys():
+    lines = [ "int main():\n", "  print 1\n" ]
+    key = cache.transpile_key("main.cpy", lines, TranspileContext())
+    assert cache.transpile_key("main.cpy", list(lines), TranspileContext()) == key
+
+    assert cache.transpile_key("other.cpy", lines, TranspileContext()) != key
+    assert cache.transpile_key("main.cpy", lines + [ "\n" ], TranspileContext()) != key
+    assert cache.transpile_key("main.cpy", lines, TranspileContext(enable_for=True)) != key
+    assert cache.transpile_key("main.cpy", lines,
+        TranspileContext(include_keywords={ "<set>": [ "set" ] })) != key
+
+    # #raw pulls in files the key doesn't cover
+    assert cache.transpile_key("main.cpy", [ "#raw \"a.h\"\n" ] + lines) is None
+
+    assert cache.fetch_transpiled(key) is None
+    cache.store_transpiled(key, [ "h" ], [ "cpp" ], { "h": [ 1 ], "cpp": [ 2 ] })
+    line_maps = {}
+    assert cache.fetch_transpiled(key, line_maps) == ([ "h" ], [ "cpp" ])
+    assert line_maps == { "h": [ 1 ], "cpp": [ 2 ] }
+
+def check_split_cache():
+    config.SPLIT_CACHE_SIZE = 4
+    util.apply_split_cache_size()
+    for i in range(20):
+        assert util.smart_split("int a%d, b" % i, ",") == ("int a%d" % i, " b")
+    assert util.smart_split("int a19, b", ",") == ("int a19", " b")
+
+    info = util.split_cache_info()
+    for name in ("smart_split", "tokenize"):
+        assert info[name]["maxsize"] == 4 and info[name]["size"] <= 4, info
+    assert info["smart_split"]["hits"] == 1, info
+
+root = tempfile.mkdtemp(prefix="okp_check")
+try:
+    config.CACHE_DIR = os.path.join(root, "cache")
+    check_object_keys(root)
+    check_objects(root)
+    check_evict()
+    check_transpile_keys()
+    check_split_cache()
+finally:
+    shutil.rmtree(root)
@@ -0,0 +1,52 @@
+# checks for okp.transforms.comments: every input line gives exactly one
+# output line, whatever the comments and strings in it look like
+
+import itertools
+
+import okp
+
+from okp.transforms.comments import skip_comments
+
+def lines_of(chunks):
+    return "".join(chunks).count("\n") + 1
+
+def check_examples():
+    cases = [
+        ([ "int x; // note\n" ], [ "int x;  ", "" ]),
+        ([ "a /* b */ c\n" ], [ "a   c", "" ]),
+        ([ "a /* b\n", "c */ d\n", "e\n" ], [ "a  ", "d", "e", "" ]),
+        # code after a multi-line comment stays on its line, indented like
+        # the line the comment started on
+        ([ "  /* a\n", "  b\n", "     c */  int x;\n" ], [ "   ", "", "  int x;", "" ]),
+        ([ 'print "/* not a comment */"\n' ], [ 'print "/* not a comment */"', "" ]),
+        ([ "x /* open\n", "c\n" ], [ "x /* open", "c", "" ]),
+        # an unclosed comment after a closed multi-line one
+        ([ "/* a\n", "b */ int x; /* open\n", "c\n", "d\n" ],
+            [ " ", "int x; /* open", "c", "d", "" ]),
+    ]
+    for chunks, expected in cases:
+        got = skip_comments(chunks)
+        assert got == expected, (chunks, got, expected)
+
+# the code after a comment keeps its .cpy line in the generated file
+def check_line_map():
+    source = "int main():\n  /* a\n     b */ int x = 1\n  print x\n"
+    out = okp.transpile_project({ "main.cpy": source })["main.cpp"]
+    for line, location in zip(out.text.split("\n"), out.line_map):
+        if "int x = 1" in line:
+            assert location == ("main.cpy", 3), (line, location)
+            break
+    else:
+        assert False, out.text
+
+def check_line_counts():
+    pieces = [ "a", "/*", "*/", "//", '"', "'", "\\", "\n", " " ]
+    for n in range(1, 6):
+        for combo in itertools.product(pieces, repeat=n):
+            chunks = [ "".join(combo) ]
+            got = skip_comments(chunks)
+            assert len(got) == lines_of(chunks), (chunks, got)
+
+check_examples()
+check_line_map()
+check_line_counts()
@@ -0,0 +1,53 @@
+# checks for okp.diagnostics: compiler locations in generated files are
+# pointed back at the .cpy lines behind them
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from okp.diagnostics import remap
+
+def check_remap():
+    cpp = os.path.abspath("build/main.cpp")
+    h = os.path.abspath("build/main.h")
+    line_maps = {
+        cpp: [ None, ("main.cpy", 1), ("main.cpy", 3) ],
+        h: [ ("main.cpy", 7) ],
+    }
+
+    cases = [
+        ("build/main.cpp:3:5: error: oops\n", "main.cpy:3:5: error: oops\n"),
+        ("%s:2: warning: hm\n" % cpp, "main.cpy:1: warning: hm\n"),
+        ("In file included from build/main.h:1,\n", "In file included from main.cpy:7,\n"),
+        ("build/main.cpp: In function 'int main()':\n", "main.cpy: In function 'int main()':\n"),
+        # lines okp added, lines past the map and files it didn't generate
+        ("build/main.cpp:1:1: error: x\n", "build/main.cpp:1:1: error: x\n"),
+        ("build/main.cpp:9:1: error: x\n", "build/main.cpp:9:1: error: x\n"),
+        ("other.cpp:2:1: error: x\n", "other.cpp:2:1: error: x\n"),
+        ("error: 'a::b' at 12:30\n", "error: 'a::b' at 12:30\n"),
+    ]
+    for text, expected in cases:
+        got = remap(text, line_maps)
+        assert got == expected, (text, got, expected)
+
+    assert remap("build/main.cpp:3: x\n", {}) == "build/main.cpp:3: x\n"
+
+# without #line directives, a compile error still names the .cpy line
+def check_compile():
+    tmp_dir = tempfile.mkdtemp(prefix="okp_check")
+    try:
+        with open(os.path.join(tmp_dir, "bad.cpy"), "w") as f:
+            f.write("int main():\n  int x = 1\n  undefined_thing(x)\n")
+
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        proc = subprocess.Popen([ sys.executable, "-c", "import okp; okp.main()", "bad.cpy", "-ns", "-nc" ],
+            cwd=tmp_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = proc.communicate()[0].decode("utf-8", "replace")
+        assert "bad.cpy:3:" in out and "undefined_thing" in out, out
+    finally:
+        shutil.rmtree(tmp_dir)
+
+check_remap()
+check_compile()
@@ -0,0 +1,82 @@
+# checks that okp.lexer.split gives the same pieces as the character by
+# character smart_split it replaced, on whole lines and on slices of them
+
+import itertools
+
+from okp import lexer
+from okp.util import find_matching
+
+# the splitter from before the lexer
+def reference_split(line, split_chars, keep_splitters=False):
+    split = []
+    prev = []
+    i = 0
+    while i < len(line):
+        c = line[i]
+        i += 1
+
+        if c in split_chars:
+            if prev:
+                split.append(''.join(prev))
+                prev = []
+
+            if keep_splitters:
+                split.append(c)
+
+        elif c == '"':
+            p, i = find_matching(line, '"', c, i)
+            prev.append(p)
+        elif c == '<':
+            p, i = find_matching(line, '<', '>', i)
+            prev.append(p)
+        elif c == '(':
+            p, i = find_matching(line, '(', ')', i)
+            prev.append(p)
+        else:
+            prev.append(c)
+
+    if prev:
+        split.append(''.join(prev))
+
+    return split
+
+PIECES = [ "a", "bc", " ", ",", '"', "<", ">", "(", ")", "=" ]
+SPLIT_CHARS = [ " ", ",", " ,", "=", "<>", "(", '"' ]
+
+def lines(max_pieces):
+    for n in range(1, max_pieces + 1):
+        for combo in itertools.product(PIECES, repeat=n):
+            yield "".join(combo)
+
+def check_examples():
+    cases = [
+        ('print "a b", c', " ", [ "print", '"a b",', "c" ]),
+        ("vector<pair<int, int>> v", " ", [ "vector<pair<int, int>>", "v" ]),
+        ("f(a, b), g(c)", ",", [ "f(a, b)", " g(c)" ]),
+        ('(") "a b"', " ", [ '(")', '"a b"' ]),
+        ("a  =b", " =", [ "a", "b" ]),
+    ]
+    for line, split_chars, expected in cases:
+        got = lexer.split(line, split_chars)
+        assert got == expected, (line, got, expected)
+
+def check_lines():
+    for line in lines(5):
+        for split_chars in SPLIT_CHARS:
+            for keep in (False, True):
+                expected = reference_split(line, split_chars, keep)
+                got = lexer.split(line, split_chars, keep)
+                assert got == expected, (line, split_chars, keep, got, expected)
+
+def check_slices():
+    for line in lines(3):
+        for start in range(len(line) + 1):
+            for end in range(start, len(line) + 1):
+                for split_chars in SPLIT_CHARS:
+                    expected = reference_split(line[start:end], split_chars, True)
+                    got = lexer.split(line, split_chars, True, start, end)
+                    assert got == expected, (line, start, end, split_chars, got, expected)
+
+check_examples()
+check_lines()
+check_slices()
@@ -0,0 +1,44 @@
+# checks for okp -j: transpiling a project's .cpy files in a process pool
+# gives the same build, and what the workers print comes out one message
+# per line
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+PROJECT = os.path.join("tests", "projects", "cpy_red_black_tree")
+
+def build(src, cache_dir, *flags):
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), OKP_CACHE_DIR=cache_dir)
+    proc = subprocess.run([ sys.executable, "-c", "import okp; okp.main()", "-v",
+        "main.cpy", "rntree.cpy", "-o", "exe" ] + list(flags),
+        cwd=src, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=300)
+    output = proc.stdout.decode("utf-8", "replace")
+    assert proc.returncode == 0, output
+
+    with open(os.path.join(src, "in")) as f:
+        run = subprocess.run([ os.path.join(src, "exe") ], stdin=f, stdout=subprocess.PIPE, timeout=60)
+    with open(os.path.join(src, "out")) as f:
+        assert run.stdout.decode("utf-8") == f.read()
+    return output
+
+def check_messages():
+    tmp_dir = tempfile.mkdtemp(prefix="okp_check")
+    try:
+        src = os.path.join(tmp_dir, "src")
+        shutil.copytree(PROJECT, src)
+        cache_dir = os.path.join(tmp_dir, "cache")
+
+        build(src, cache_dir, "-j", "1")
+        output = build(src, cache_dir, "-j", "2")
+        assert "transpiling 2 files with 2 processes" in output, output
+        cached = [ line for line in output.splitlines() if "using cached transpile" in line ]
+        assert len(cached) == 2, output
+        for line in cached:
+            assert line.count("using cached transpile") == 1 and line.endswith(".cpy"), output
+    finally:
+        shutil.rmtree(tmp_dir)
+
+check_messages()
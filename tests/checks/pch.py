@@ -0,0 +1,75 @@
+# checks for okp --pch: the key covers the compiler, its flags and the
+# headers, and a second build reuses the precompiled header from the cache
+
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from okp import pch
+
+SOURCE = "int main():\n  vector<int> v = { 1, 2 }\n  print v.size()\n"
+
+def check_keys(tmp_dir):
+    includes = [ "<iostream>", "<vector>" ]
+    key = pch.pch_key("g++", [ "-O2" ], includes)
+    assert pch.pch_key("g++", [ "-O2" ], list(includes)) == key
+    assert pch.pch_key("g++", [ "-O0" ], includes) != key
+    assert pch.pch_key("g++", [ "-O2", "-DX" ], includes) != key
+    assert pch.pch_key("g++", [ "-O2" ], includes + [ "<map>" ]) != key
+    assert pch.pch_key("clang++", [ "-O2" ], includes) != key
+
+    # an upgraded compiler keeps its name but not its mtime or size
+    cxx = os.path.join(tmp_dir, "fake-g++")
+    with open(cxx, "w") as f:
+        f.write("#!/bin/sh\n")
+    os.chmod(cxx, 0o755)
+    os.utime(cxx, (1000, 1000))
+    key = pch.pch_key(cxx, [ "-O2" ], includes)
+    os.utime(cxx, (2000, 2000))
+    assert pch.pch_key(cxx, [ "-O2" ], includes) != key
+
+def build(src, cache_dir, *flags):
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), OKP_CACHE_DIR=cache_dir)
+    proc = subprocess.run([ sys.executable, "-c", "import okp; okp.main()", "-v", "--pch",
+        "main.cpy", "-o", "exe" ] + list(flags),
+        cwd=src, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=300)
+    output = proc.stdout.decode("utf-8", "replace")
+    assert proc.returncode == 0, output
+
+    run = subprocess.run([ os.path.join(src, "exe") ], stdout=subprocess.PIPE, timeout=60)
+    assert run.stdout == b"2\n", (run.stdout, output)
+    return output
+
+def gchs(cache_dir):
+    return sorted(glob.glob(os.path.join(cache_dir, "pch", "*", "*", pch.PCH_NAME + ".gch")))
+
+def check_builds(tmp_dir):
+    src = os.path.join(tmp_dir, "src")
+    os.makedirs(src)
+    with open(os.path.join(src, "main.cpy"), "w") as f:
+        f.write(SOURCE)
+    cache_dir = os.path.join(tmp_dir, "cache")
+
+    output = build(src, cache_dir)
+    assert "c++-header" in output and "-include" in output, output
+    first = gchs(cache_dir)
+    assert len(first) == 1, first
+
+    output = build(src, cache_dir)
+    assert "using precompiled header" in output and "c++-header" not in output, output
+    assert gchs(cache_dir) == first
+
+    # other flags need their own precompiled header
+    output = build(src, cache_dir, "-DOKP_CHECK")
+    assert "c++-header" in output, output
+    assert len(gchs(cache_dir)) == 2, gchs(cache_dir)
+
+tmp_dir = tempfile.mkdtemp(prefix="okp_check")
+try:
+    check_keys(tmp_dir)
+    check_builds(tmp_dir)
+finally:
+    shutil.rmtree(tmp_dir)
@@ -0,0 +1,127 @@
+# checks for okp.analysis scopes: chained frames see what copying every
+# scope (the way read_scopings used to) saw
+
+import glob
+import random
+
+from okp import analysis
+from okp import id_recognizer
+from okp.util import get_indent, visibility_line
+
+# read_scopings from before scopes were chained: each new scope is a copy
+# of its parent and each line gets a list of the names it can see
+def reference_scopings(lines):
+    indent_levels = [0]
+    nb = 0
+    scopings = {}
+    scope = {}
+    scope_stack = { 0: scope }
+
+    for i, line in enumerate(lines):
+        line = line.rstrip('\n')
+        indent = get_indent(line)
+
+        if indent in scope_stack:
+            scope = scope_stack[indent]
+        else:
+            scope = {}
+            scope_stack[indent] = scope
+
+        scopings[i] = [c for c in scope]
+
+        if not line:
+            continue
+
+        if visibility_line(line):
+            continue
+
+        nb = i
+
+        if indent_levels[-1] > indent:
+            while indent_levels[-1] > indent:
+                indent_levels.pop()
+                scope = scope_stack[indent_levels[-1]]
+
+        if indent_levels[-1] < indent:
+            if not visibility_line(lines[nb]):
+                indent_levels.append(indent)
+
+                scope = dict([(c, c) for c in scope])
+                scope_stack[indent] = scope
+
+        if i < len(lines) - 1:
+            x = 1
+            while i+x < len(lines) -1 and not lines[i+x].strip() :
+                x += 1
+
+            next_indent = get_indent(lines[i+x])
+            if indent < next_indent:
+                scope = dict([(c, c) for c in scope])
+                scope_stack[next_indent] = scope
+
+        id_recognizer.add_identifiers(line, scope)
+
+    return scopings
+
+def names_in(lines):
+    names = set()
+    for line in lines:
+        names.update(w for w in analysis.smart_split(line.strip(), " ,=();*&") if w.isidentifier())
+    return names
+
+def compare(lines):
+    got = analysis.read_scopings(lines)
+    expected = reference_scopings(lines)
+    names = names_in(lines)
+    for i in range(len(lines)):
+        for name in names:
+            assert (name in got[i]) == (name in expected[i]), (lines, i, name)
+
+def check_frames():
+    top = analysis.Scope()
+    top.line = 0
+    top["a"] = 1
+    inner = top.child(1)
+    inner.line = 2
+    inner["b"] = 1
+    top.line = 3
+    top["c"] = 1
+
+    assert "a" in inner and "b" in inner
+    # the parent gained c after inner was opened
+    assert "c" not in inner and "c" in top
+    assert "b" not in top
+    assert analysis.ScopeView(inner, 2).scope is inner
+    assert "b" not in analysis.ScopeView(inner, 2)
+    assert "b" in analysis.ScopeView(inner, 3)
+    assert "a" not in analysis.ScopeView(top, 0)
+
+def random_program(rng):
+    lines = []
+    indent = 0
+    for _ in range(rng.randint(1, 25)):
+        indent = max(0, indent + rng.choice([ -4, -4, 0, 0, 4 ]))
+        body = rng.choice([
+            "int %s = 1" % rng.choice("abcde"),
+            "%s = 2" % rng.choice("abcde"),
+            "def f(int %s):" % rng.choice("abcde"),
+            "if %s:" % rng.choice("abcde"),
+            "public:",
+            "",
+        ])
+        lines.append((" " * indent + body + "\n") if body else "\n")
+    return lines
+
+def check_files():
+    for path in sorted(glob.glob("tests/*.cpy")):
+        with open(path) as f:
+            compare(f.readlines())
+
+def check_random():
+    rng = random.Random(11)
+    for _ in range(300):
+        compare(random_program(rng))
+
+check_frames()
+check_files()
+check_random()
@@ -0,0 +1,67 @@
+# checks for okp.single_header.top_sort: files come after what they
+# include, the order is stable and a cycle is reported as a real loop
+
+import random
+
+from okp.single_header import IncludeCycle, top_sort
+
+def check_order(graph, order):
+    assert sorted(order) == sorted(graph), (graph, order)
+    position = dict((f, i) for i, f in enumerate(order))
+    for f, deps in graph.items():
+        for dep in deps:
+            assert position[dep] < position[f], (graph, order, f, dep)
+
+def check_cycle(graph, cycle):
+    assert len(cycle) >= 2 and cycle[0] == cycle[-1], cycle
+    for f, dep in zip(cycle, cycle[1:]):
+        assert dep in graph[f], (graph, cycle)
+
+def check_examples():
+    graph = { "main.cpp": { "a.h", "b.h" }, "a.h": { "c.h" }, "b.h": { "c.h" }, "c.h": set() }
+    assert top_sort(graph) == [ "c.h", "a.h", "b.h", "main.cpp" ]
+    assert top_sort({}) == []
+
+    graph = { "a.h": { "b.h" }, "b.h": { "c.h" }, "c.h": { "a.h" }, "main.cpp": { "a.h" } }
+    try:
+        top_sort(graph)
+        assert False, "no cycle found"
+    except IncludeCycle as e:
+        assert e.cycle == [ "a.h", "b.h", "c.h", "a.h" ], e.cycle
+        assert "a.h -> b.h -> c.h -> a.h" in str(e)
+
+    try:
+        top_sort({ "a.h": { "a.h" } })
+        assert False, "no cycle found"
+    except IncludeCycle as e:
+        assert e.cycle == [ "a.h", "a.h" ], e.cycle
+
+def random_graph(rng, acyclic):
+    names = [ "f%d.h" % i for i in range(rng.randint(1, 12)) ]
+    graph = dict((name, set()) for name in names)
+    for i, name in enumerate(names):
+        for j, dep in enumerate(names):
+            if i != j and (j < i or not acyclic) and rng.random() < 0.2:
+                graph[name].add(dep)
+    return graph
+
+def check_random():
+    rng = random.Random(13)
+    for _ in range(500):
+        graph = random_graph(rng, acyclic=True)
+        order = top_sort(graph)
+        check_order(graph, order)
+        # the order doesn't depend on how the graph was built
+        shuffled = list(graph.items())
+        rng.shuffle(shuffled)
+        assert top_sort(dict((f, set(deps)) for f, deps in shuffled)) == order
+
+    for _ in range(500):
+        graph = random_graph(rng, acyclic=False)
+        try:
+            check_order(graph, top_sort(graph))
+        except IncludeCycle as e:
+            check_cycle(graph, e.cycle)
+
+check_examples()
+check_random()
@@ -0,0 +1,71 @@
+# checks for okp --unity: a hybrid project builds and runs the same with
+# and without unity units, and files whose statics clash are compiled on
+# their own instead of breaking the unit they'd share
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from okp import unity
+
+FILES = {
+    "util_a.cpp": "static int helper() { return 1; }\nint a_value() { return helper(); }\n",
+    "util_b.cpp": "static int helper() { return 2; }\nint b_value() { return helper(); }\n",
+    "util_c.cpp": "static int offset = 3;\nint c_value() { return offset; }\n",
+    "values.h": "int a_value();\nint b_value();\nint c_value();\n",
+    "main.cpy": '#include "values.h"\n\nint main():\n  print a_value(), b_value(), c_value()\n',
+}
+SOURCES = [ "main.cpy", "values.h", "util_a.cpp", "util_b.cpp", "util_c.cpp" ]
+
+def build_and_run(src, *flags):
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    proc = subprocess.run([ sys.executable, "-c", "import okp; okp.main()", "-v", "-nc",
+        "-o", "exe" ] + SOURCES + list(flags),
+        cwd=src, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=300)
+    output = proc.stdout.decode("utf-8", "replace")
+    assert proc.returncode == 0, output
+
+    run = subprocess.run([ os.path.join(src, "exe") ], stdout=subprocess.PIPE, timeout=60)
+    return run.stdout.decode("utf-8"), output
+
+def check_static_names(src):
+    cpps = [ os.path.join(src, name) for name in [ "util_a.cpp", "util_b.cpp", "util_c.cpp" ] ]
+    assert unity.static_names(cpps[0]) == set([ "helper" ])
+    assert unity.static_names(cpps[2]) == set([ "offset" ])
+    ok, clashing = unity.split_static_clashes(cpps)
+    assert ok == cpps[2:] and clashing == cpps[:2], (ok, clashing)
+
+    # the clash is real: the two files don't compile as one unit
+    units = unity.write_units(src, cpps[:2])
+    proc = subprocess.run([ "g++", "-c", units[0][0], "-o", os.path.join(src, "unit.o") ],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert proc.returncode != 0 and b"helper" in proc.stdout, proc.stdout
+
+def check_build(src):
+    expected, _ = build_and_run(src)
+    assert expected == "1 2 3\n", expected
+
+    for flags in ([ "--unity" ], [ "--unity", "--unity-units", "2" ]):
+        got, output = build_and_run(src, *flags)
+        assert got == expected, (flags, got, output)
+        assert "static helper is defined in" in output, output
+        assert "okp_unity_0.cpp" in output, output
+
+    # main.cpp and util_c.cpp share the unit, the clashing files don't
+    _, output = build_and_run(src, "--unity")
+    unit_lines = [ line for line in output.splitlines() if line.startswith("unity file") ]
+    assert len(unit_lines) == 1, output
+    assert "main.cpp" in unit_lines[0] and "util_c.cpp" in unit_lines[0], unit_lines
+    assert "util_a.cpp" not in unit_lines[0] and "util_b.cpp" not in unit_lines[0], unit_lines
+
+tmp_dir = tempfile.mkdtemp(prefix="okp_check")
+try:
+    for name, text in FILES.items():
+        with open(os.path.join(tmp_dir, name), "w") as f:
+            f.write(text)
+    check_static_names(tmp_dir)
+    check_build(tmp_dir)
+finally:
+    shutil.rmtree(tmp_dir)